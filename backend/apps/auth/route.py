@@ -6,6 +6,7 @@ from apps.auth.utils import authenticate_user, create_access_token, get_password
 from db.mongo import get_collection
 from constants import ACCESS_TOKEN_EXPIRE_MINUTES
 from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
 
 router = APIRouter()
 
@@ -31,7 +32,14 @@ async def signup(user_data: UserCreate):
         "notebook_pages": []
     }
     
-    result = user_collection.insert_one(new_user)
+    try:
+        result = user_collection.insert_one(new_user)
+    except DuplicateKeyError:
+        # Concurrent signups with the same email, caught by the unique index
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email already registered"
+        )
     new_user["id"] = str(result.inserted_id)
     
     return {
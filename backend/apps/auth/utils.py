@@ -1,26 +1,33 @@
 import jwt
 from datetime import datetime, timedelta
+from functools import lru_cache
 from typing import Optional
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
 from constants import SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES
 from models.user import TokenData
 from db.mongo import get_collection
 from bson import ObjectId
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="auth/token", auto_error=False)
+
+@lru_cache(maxsize=None)
+def password_context():
+    # passlib and bcrypt are only needed on login and signup, not to start serving
+    from passlib.context import CryptContext
+    return CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+    return password_context().verify(plain_password, hashed_password)
 
 def get_password_hash(password):
-    return pwd_context.hash(password)
+    return password_context().hash(password)
 
-def get_user(email: str):
+def get_user(email: str, projection: Optional[dict] = None):
     user_collection = get_collection("users")
-    user = user_collection.find_one({"email": email})
+    user = user_collection.find_one({"email": email}, projection)
     return user
 
 def authenticate_user(email: str, password: str):
@@ -42,6 +49,13 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    return await user_from_token(token)
+
+async def get_current_user_without_pages(token: str = Depends(oauth2_scheme)):
+    # For endpoints that stream or write pages themselves, skips loading every canvas
+    return await user_from_token(token, projection={"notebook_pages": 0})
+
+async def user_from_token(token: str, projection: Optional[dict] = None):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -95,18 +109,34 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         print(f"Unexpected auth error: {str(e)}")
         raise credentials_exception
         
-    # Get the user from the database
+    # Get the user from the database, off the event loop: every authenticated request does this
     try:
-        user = get_user(email=token_data.email)
+        user = await run_in_threadpool(get_user, token_data.email, projection)
         if user is None:
             print(f"User not found for email: {token_data.email}")
             raise credentials_exception
             
         print(f"Authentication successful for user: {user['email']}")
         return user
+    except HTTPException:
+        raise
     except Exception as db_error:
         print(f"Database error when getting user: {str(db_error)}")
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving user data"
-        )
\ No newline at end of file
+        )
+
+async def get_optional_user(token: Optional[str] = Depends(oauth2_scheme_optional)):
+    # For endpoints that also serve anonymous callers, such as /calculate
+    if not token:
+        return None
+    try:
+        # Callers only need who is asking, never the notebook's canvases
+        return await user_from_token(token, projection={"email": 1})
+    except HTTPException as e:
+        # Only a bad token makes the caller anonymous. When the database is down the
+        # request fails instead, otherwise a signed-in user's work would be saved as anonymous
+        if e.status_code == status.HTTP_401_UNAUTHORIZED:
+            return None
+        raise
@@ -0,0 +1,265 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from io import BytesIO
+from typing import TYPE_CHECKING
+from fastapi.concurrency import run_in_threadpool
+from apps.calculator.utils import analyze_image, init_model_client
+from constants import (
+    INFERENCE_BACKENDS, GEMINI_TIMEOUT, STUB_TIMEOUT,
+    HEDGE_ENABLED, HEDGE_MIN_DELAY, HEDGE_MIN_SAMPLES, HEDGE_MAX_INFLIGHT,
+    CIRCUIT_ERROR_THRESHOLD, CIRCUIT_MIN_REQUESTS, CIRCUIT_WINDOW_SECONDS, CIRCUIT_COOLDOWN_SECONDS,
+)
+
+if TYPE_CHECKING:
+    from PIL.Image import Image
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceUnavailable(Exception):
+    pass
+
+
+class InferenceBackend:
+    """A model that turns a canvas image into a list of {'expr', 'result', 'assign'} dicts.
+
+    analyze() is blocking and always runs in the threadpool.
+    """
+
+    name = "base"
+    timeout = 30.0
+    # Answers from a degraded backend are placeholders, not solutions
+    degraded = False
+
+    def init(self):
+        pass
+
+    def analyze(self, img: "Image", dict_of_vars: dict) -> list:
+        raise NotImplementedError
+
+
+class GeminiBackend(InferenceBackend):
+    name = "gemini"
+    timeout = GEMINI_TIMEOUT
+
+    def init(self):
+        init_model_client()
+
+    def analyze(self, img: "Image", dict_of_vars: dict) -> list:
+        return analyze_image(img, dict_of_vars=dict_of_vars)
+
+
+class StubBackend(InferenceBackend):
+    """Local last resort that answers instantly so callers are never left hanging."""
+
+    name = "stub"
+    timeout = STUB_TIMEOUT
+    degraded = True
+
+    def analyze(self, img: "Image", dict_of_vars: dict) -> list:
+        return [{
+            "expr": "Model unavailable",
+            "result": "The drawing could not be analyzed right now, please try again shortly",
+            "assign": False,
+        }]
+
+
+BACKENDS = {backend.name: backend for backend in (GeminiBackend, StubBackend)}
+
+
+class LatencyTracker:
+    def __init__(self, size: int = 200):
+        self.samples = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self.samples.append(seconds)
+
+    def percentile(self, p: float):
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(p * len(ordered)))]
+
+
+class CircuitBreaker:
+    """closed -> open when the windowed error rate crosses the threshold,
+    open -> half-open after the cooldown, then one probe call decides."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.outcomes = deque()  # (timestamp, ok)
+        self.state = "closed"
+        self.opened_at = 0.0
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.state == "open":
+            if time.monotonic() - self.opened_at < CIRCUIT_COOLDOWN_SECONDS:
+                return False
+            self.state = "half-open"
+        if self.state == "half-open":
+            if self.probing:
+                return False
+            self.probing = True
+        return True
+
+    def record(self, ok: bool):
+        now = time.monotonic()
+        if self.state == "half-open":
+            self.probing = False
+            if ok:
+                self.state = "closed"
+                self.outcomes.clear()
+            else:
+                self._open(now)
+            return
+
+        self.outcomes.append((now, ok))
+        while self.outcomes and now - self.outcomes[0][0] > CIRCUIT_WINDOW_SECONDS:
+            self.outcomes.popleft()
+        errors = sum(1 for _, success in self.outcomes if not success)
+        if len(self.outcomes) >= CIRCUIT_MIN_REQUESTS and errors / len(self.outcomes) >= CIRCUIT_ERROR_THRESHOLD:
+            self._open(now)
+
+    def release_probe(self):
+        # A probe that was cancelled (e.g. lost a hedge race) decides nothing
+        self.probing = False
+
+    def _open(self, now: float):
+        if self.state != "open":
+            logger.warning(f"Circuit for '{self.name}' opened after repeated inference failures")
+        self.state = "open"
+        self.opened_at = now
+        self.outcomes.clear()
+
+
+class BackendState:
+    def __init__(self, backend: InferenceBackend):
+        self.backend = backend
+        self.latency = LatencyTracker()
+        self.breaker = CircuitBreaker(backend.name)
+        self.initialized = False
+
+    def hedge_delay(self):
+        if not HEDGE_ENABLED or len(self.latency.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return max(HEDGE_MIN_DELAY, self.latency.percentile(0.95))
+
+
+class InferenceRouter:
+    """Runs a request against the configured backends in order, with a
+    per-backend timeout, a hedged second attempt past p95 latency, circuit
+    breaking and fallback to the next backend."""
+
+    def __init__(self, backends: list):
+        self.states = [BackendState(backend) for backend in backends]
+        self.hedges_inflight = 0
+
+    def init(self):
+        # Safe to call again, only backends that failed before are retried
+        for state in self.states:
+            if state.initialized:
+                continue
+            try:
+                state.backend.init()
+                state.initialized = True
+                logger.info(f"Inference backend '{state.backend.name}' initialized")
+            except Exception as e:
+                logger.error(f"Failed to initialize inference backend '{state.backend.name}': {str(e)}")
+
+    @property
+    def ready(self) -> bool:
+        # The first backend is the real model, the ones after it are fallbacks
+        return bool(self.states) and self.states[0].initialized
+
+    def stats(self):
+        return {
+            state.backend.name: {
+                "circuit": state.breaker.state,
+                "p50": state.latency.percentile(0.5),
+                "p95": state.latency.percentile(0.95),
+            }
+            for state in self.states
+        }
+
+    async def analyze(self, image_data: bytes, dict_of_vars: dict):
+        """Returns (results, degraded), degraded being True when a placeholder
+        backend answered because every real model was unavailable."""
+        last_error = None
+        for state in self.states:
+            if not state.breaker.allow():
+                logger.info(f"Skipping inference backend '{state.backend.name}', circuit is {state.breaker.state}")
+                continue
+            try:
+                results = await self._hedged(state, image_data, dict_of_vars)
+                return results, state.backend.degraded
+            except asyncio.CancelledError:
+                state.breaker.release_probe()
+                raise
+            except Exception as e:
+                logger.warning(f"Inference backend '{state.backend.name}' failed: {type(e).__name__}: {str(e)}")
+                last_error = e
+        raise InferenceUnavailable(f"No inference backend could serve the request: {last_error}")
+
+    async def _hedged(self, state: BackendState, image_data: bytes, dict_of_vars: dict):
+        attempts = {asyncio.ensure_future(self._attempt(state, image_data, dict_of_vars))}
+        hedged = False
+        try:
+            delay = state.hedge_delay()
+            if delay is not None:
+                done, _ = await asyncio.wait(attempts, timeout=delay)
+                if not done and self.hedges_inflight < HEDGE_MAX_INFLIGHT:
+                    logger.info(f"Hedging '{state.backend.name}' call after {delay:.2f}s")
+                    self.hedges_inflight += 1
+                    hedged = True
+                    attempts.add(asyncio.ensure_future(self._attempt(state, image_data, dict_of_vars)))
+
+            # First successful attempt wins, an error only counts once every attempt failed
+            error = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            if hedged:
+                self.hedges_inflight -= 1
+
+    async def _attempt(self, state: BackendState, image_data: bytes, dict_of_vars: dict):
+        backend = state.backend
+        start = time.monotonic()
+        try:
+            # A timed out call keeps its worker thread until the SDK returns, the caller moves on
+            result = await asyncio.wait_for(
+                run_in_threadpool(self._run, backend, image_data, dict_of_vars), backend.timeout
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            state.breaker.record(False)
+            raise
+        state.latency.add(time.monotonic() - start)
+        state.breaker.record(True)
+        return result
+
+    @staticmethod
+    def _run(backend: InferenceBackend, image_data: bytes, dict_of_vars: dict):
+        from PIL import Image
+        # Every attempt opens its own image, PIL images are not safe to share between threads
+        return backend.analyze(Image.open(BytesIO(image_data)), dict_of_vars)
+
+
+def build_router(names: list) -> InferenceRouter:
+    unknown = [name for name in names if name not in BACKENDS]
+    if unknown:
+        raise ValueError(f"Unknown inference backend(s): {', '.join(unknown)}")
+    return InferenceRouter([BACKENDS[name]() for name in names])
+
+
+inference = build_router(INFERENCE_BACKENDS)
@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from db.mongo import get_collection
+from constants import JOB_WORKERS, JOB_QUEUE_SIZE, JOB_TTL_SECONDS, JOB_POLL_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ("succeeded", "failed")
+
+
+def _ms(start: datetime, end: datetime) -> int:
+    return int((end - start).total_seconds() * 1000)
+
+
+class JobQueue:
+    """Runs solves in a bounded pool of worker tasks and persists their state in
+    the calculation_jobs collection (expired by a TTL index), so any worker can
+    answer a status poll. Jobs submitted to this process are also kept in memory
+    to notify WebSocket listeners without polling Mongo."""
+
+    def __init__(self, solver):
+        self.solver = solver
+        self.queue = asyncio.Queue(maxsize=JOB_QUEUE_SIZE)
+        self.workers = []
+        self.local = {}
+        self.changed = {}
+
+    def _get_collection(self):
+        # Finished jobs are removed by the TTL index declared in db/indexes.py
+        return get_collection("calculation_jobs")
+
+    async def _persist(self, job: dict, fields: dict):
+        job.update(fields)
+        # Wake up anyone waiting on this job, the next waiter arms a fresh event
+        self.changed.pop(job["_id"], asyncio.Event()).set()
+        try:
+            await run_in_threadpool(
+                self._get_collection().update_one, {"_id": job["_id"]}, {"$set": fields}, upsert=True
+            )
+        except Exception as e:
+            # The submitting worker still has the job in memory and can answer for it
+            logger.error(f"Failed to persist job {job['_id']}: {str(e)}")
+
+    def start(self):
+        self.workers = [asyncio.create_task(self._work(i)) for i in range(JOB_WORKERS)]
+        logger.info(f"Started {JOB_WORKERS} job worker(s)")
+
+    async def stop(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutdown timeout reached with unfinished jobs")
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        for job in self.local.values():
+            if job["status"] not in TERMINAL_STATUSES:
+                await self._persist(job, {"status": "failed", "error": "Server restarted before the job finished"})
+
+    async def submit(self, data, client_key: str, user_id: str = None) -> dict:
+        self._prune()
+        now = datetime.now(timezone.utc)
+        job = {
+            "_id": uuid.uuid4().hex,
+            "status": "queued",
+            "client_key": client_key,
+            "user_id": user_id,
+            "submitted_at": now,
+            "expires_at": now + timedelta(seconds=JOB_TTL_SECONDS),
+        }
+        queue_full = HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many queued jobs, please try again shortly",
+            headers={"Retry-After": "5"},
+        )
+        if self.queue.full():
+            raise queue_full
+        # Persist before queueing so a fast worker's "running" write cannot be overtaken
+        self.local[job["_id"]] = job
+        await self._persist(job, {key: value for key, value in job.items() if key != "_id"})
+        try:
+            self.queue.put_nowait((job, data))
+        except asyncio.QueueFull:
+            await self._persist(job, {"status": "failed", "error": "Job queue was full"})
+            raise queue_full
+        return job
+
+    async def get(self, job_id: str):
+        job = self.local.get(job_id)
+        if job is not None:
+            return job
+        try:
+            return await run_in_threadpool(self._get_collection().find_one, {"_id": job_id})
+        except Exception as e:
+            logger.error(f"Failed to load job {job_id}: {str(e)}")
+            return None
+
+    async def wait_for_change(self, job_id: str, timeout: float = JOB_POLL_INTERVAL):
+        if job_id in self.local:
+            event = self.changed.setdefault(job_id, asyncio.Event())
+            try:
+                await asyncio.wait_for(event.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        else:
+            # Submitted to another worker, fall back to polling the collection
+            await asyncio.sleep(timeout)
+        return await self.get(job_id)
+
+    async def _work(self, index: int):
+        while True:
+            job, data = await self.queue.get()
+            try:
+                started = datetime.now(timezone.utc)
+                await self._persist(job, {
+                    "status": "running",
+                    "started_at": started,
+                    "queue_wait_ms": _ms(job["submitted_at"], started),
+                })
+                try:
+                    result = await self.solver(data, job["client_key"], job["user_id"])
+                    fields = {"status": "succeeded", "result": result}
+                except HTTPException as e:
+                    fields = {"status": "failed", "error": e.detail}
+                except Exception as e:
+                    logger.error(f"Job {job['_id']} failed: {str(e)}", exc_info=True)
+                    fields = {"status": "failed", "error": "The job could not be completed"}
+                finished = datetime.now(timezone.utc)
+                fields.update({"finished_at": finished, "run_ms": _ms(started, finished)})
+                await self._persist(job, fields)
+            finally:
+                self.queue.task_done()
+
+    def _prune(self):
+        now = datetime.now(timezone.utc)
+        for job_id in [job_id for job_id, job in self.local.items() if job["expires_at"] < now]:
+            del self.local[job_id]
+            self.changed.pop(job_id, None)
+
+
+def public_job(job: dict) -> dict:
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "submitted_at": job.get("submitted_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "queue_wait_ms": job.get("queue_wait_ms"),
+        "run_ms": job.get("run_ms"),
+        "data": job.get("result"),
+        "error": job.get("error"),
+    }
@@ -1,19 +1,119 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+import asyncio
 import base64
-from io import BytesIO
-from apps.calculator.utils import analyze_image
+import hashlib
+import json
+from typing import Optional
+from apps.calculator.backends import inference, InferenceUnavailable
+from apps.calculator.jobs import JobQueue, TERMINAL_STATUSES, public_job
+from apps.auth.utils import get_optional_user
+from apps.notebook.variables import load_graph, update_graph
+from apps.notebook.utils import save_page_results
+from core.inflight import InflightTracker
+from core.ratelimit import client_key, rate_limit
+from core.scheduler import FairScheduler
+from core.singleflight import SingleFlight
+from constants import INFERENCE_CONCURRENCY, INFERENCE_MAX_QUEUED_PER_CLIENT
 from schema import ImageData
-from PIL import Image
 
 router = APIRouter()
 
-@router.post('')
-async def run(data: ImageData):
-    image_data = base64.b64decode(data.image.split(",")[1])  # Assumes data:image/png;base64,<data>
-    image_bytes = BytesIO(image_data)
-    image = Image.open(image_bytes)
+# Running model calls, reported by /readyz
+inflight = InflightTracker("calculate")
+# Admission control for the model, shared fairly between clients when saturated
+scheduler = FairScheduler(INFERENCE_CONCURRENCY, INFERENCE_MAX_QUEUED_PER_CLIENT)
+# Double-clicks and duplicate tabs send the same canvas, run the model once for all of them
+flights = SingleFlight()
 
-    responses = analyze_image(image, dict_of_vars=data.dict_of_vars)
+MODEL_UNAVAILABLE = "The model is unavailable, please try again shortly"
+
+def decode_image(image: str) -> bytes:
+    return base64.b64decode(image.split(",")[1])  # Assumes data:image/png;base64,<data>
+
+def request_key(data: ImageData) -> str:
+    digest = hashlib.sha256(data.image.encode())
+    digest.update(json.dumps(data.dict_of_vars, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+async def solve_request(data: ImageData, key: str):
+    async def scheduled_solve():
+        # Queued under the key of the caller that started the flight, for fairness only
+        async with scheduler.slot(key):
+            # Decoding is blocking, keep it off the event loop like the model calls
+            image_data = await run_in_threadpool(decode_image, data.image)
+            return await inference.analyze(image_data, data.dict_of_vars)
+
+    # Each caller is admitted on its own queue, before it can join another caller's flight
+    scheduler.admit(key)
+    try:
+        async with inflight:
+            return await flights.do(request_key(data), scheduled_solve)
+    except InferenceUnavailable as e:
+        print(f"Inference unavailable: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=MODEL_UNAVAILABLE,
+            headers={"Retry-After": "5"},
+        )
+
+async def solve_page(data: ImageData, key: str, user_id: str = None):
+    # Signed-in canvases that name their page feed the notebook's variable graph
+    track = bool(user_id and data.page_id)
+    if track:
+        try:
+            graph = await run_in_threadpool(load_graph, user_id)
+            # Variables the notebook already knows no longer depend on the client resending them
+            data = data.model_copy(update={"dict_of_vars": {**graph.variables, **data.dict_of_vars}})
+        except Exception as e:
+            print(f"Error loading variable graph: {str(e)}")
+
+    responses, degraded = await solve_request(data, key)
+
+    updated, conflicts = [], {}
+    # Placeholder answers from the fallback backend must not end up in the notebook
+    if track and not degraded:
+        try:
+            saved = await run_in_threadpool(save_page_results, user_id, data.page_id, responses)
+            if not saved:
+                # Only pages stored in the notebook feed its variables, not any id a client sends
+                print(f"Page {data.page_id} is not in the notebook, variables not recorded")
+        except Exception as e:
+            print(f"Error saving page results: {str(e)}")
+            saved = False
+        if saved:
+            try:
+                graph, updated = await run_in_threadpool(
+                    update_graph, user_id, lambda graph: graph.record_results(data.page_id, responses)
+                )
+                # Variables this page defines that another expression defines differently are left unset
+                conflicts = {
+                    name: definers for name, definers in graph.conflicts().items()
+                    if any(definer["page_id"] == data.page_id for definer in definers)
+                }
+                if conflicts:
+                    print(f"Conflicting definitions of {', '.join(conflicts)} on page {data.page_id}")
+            except Exception as e:
+                print(f"Error recording variables: {str(e)}")
+    return responses, updated, conflicts, degraded
+
+async def solve_job(data: ImageData, key: str, user_id: str = None) -> list:
+    responses, _, _, degraded = await solve_page(data, key, user_id)
+    if degraded:
+        # Nobody is waiting on the placeholder text, fail the job so the client can retry
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=MODEL_UNAVAILABLE)
+    return responses
+
+# Long solves (graphical word problems) run here so the HTTP request can return at once
+jobs = JobQueue(solve_job)
+
+def user_id_of(current_user):
+    return str(current_user["_id"]) if current_user else None
+
+@router.post('', dependencies=[Depends(rate_limit("model"))])
+async def run(data: ImageData, request: Request, current_user = Depends(get_optional_user)):
+    responses, updated, conflicts, degraded = await solve_page(data, client_key(request), user_id_of(current_user))
 
     # Store responses in a new list
     result_list = []
@@ -23,4 +123,63 @@ async def run(data: ImageData):
     # Print the entire list (instead of using `response` outside the loop)
     print("response in route:", responses)
 
-    return {"message": "Image processed", "data": result_list, "status": "success"}
\ No newline at end of file
+    # Expressions elsewhere in the notebook recomputed from the newly assigned variables
+    if degraded:
+        # Answered by the fallback backend: a placeholder, nothing was saved to the notebook
+        return {"message": MODEL_UNAVAILABLE, "data": result_list, "updated": [], "conflicts": {}, "status": "degraded", "degraded": True}
+    return {"message": "Image processed", "data": result_list, "updated": updated, "conflicts": conflicts, "status": "success", "degraded": False}
+
+@router.post('/jobs', status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(rate_limit("model"))])
+async def submit_job(data: ImageData, request: Request, current_user = Depends(get_optional_user)):
+    job = await jobs.submit(data, client_key(request), user_id_of(current_user))
+    print(f"Queued calculation job {job['_id']}")
+    return public_job(job)
+
+def owns_job(job: dict, current_user) -> bool:
+    # Anonymous jobs are only reachable through their unguessable id
+    return job.get("user_id") is None or job["user_id"] == user_id_of(current_user)
+
+@router.get('/jobs/{job_id}', dependencies=[Depends(rate_limit("default"))])
+async def get_job(job_id: str, current_user = Depends(get_optional_user)):
+    job = await jobs.get(job_id)
+    # Someone else's job is reported as missing rather than forbidden
+    if job is None or not owns_job(job, current_user):
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return public_job(job)
+
+@router.websocket('/jobs/{job_id}/ws')
+async def job_updates(websocket: WebSocket, job_id: str, token: Optional[str] = None):
+    # Pushes the job state on every status change and closes once it has finished.
+    # Browsers cannot set headers on a WebSocket, so the token may come as ?token=
+    await websocket.accept()
+    authorization = websocket.headers.get("authorization", "")
+    if not token and authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer "):]
+    job = await jobs.get(job_id)
+    if job is None or not owns_job(job, await get_optional_user(token)):
+        await websocket.close(code=4404, reason="Job not found")
+        return
+    last_status = job["status"]
+    await websocket.send_json(jsonable_encoder(public_job(job)))
+    # Reading from the socket is the only way to notice the client went away
+    receive = asyncio.create_task(websocket.receive())
+    try:
+        while last_status not in TERMINAL_STATUSES:
+            change = asyncio.create_task(jobs.wait_for_change(job_id))
+            await asyncio.wait((receive, change), return_when=asyncio.FIRST_COMPLETED)
+            if receive.done():
+                change.cancel()
+                if receive.result()["type"] == "websocket.disconnect":
+                    return
+                # Anything the client sends is ignored
+                receive = asyncio.create_task(websocket.receive())
+                continue
+            job = change.result()
+            if job is None:
+                break
+            if job["status"] != last_status:
+                last_status = job["status"]
+                await websocket.send_json(jsonable_encoder(public_job(job)))
+    finally:
+        receive.cancel()
+    await websocket.close()
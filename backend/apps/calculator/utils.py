@@ -26,16 +26,28 @@
 #     for text in generated_text:
 #         print(text.split("ASSISTANT:")[-1])
 
-import google.generativeai as genai
 import ast
 import json
-from PIL import Image
-from constants import GEMINI_API_KEY
+from typing import TYPE_CHECKING
+from constants import GEMINI_API_KEY, GEMINI_MODEL
 
-genai.configure(api_key=GEMINI_API_KEY)
+if TYPE_CHECKING:
+    from PIL.Image import Image
 
-def analyze_image(img: Image, dict_of_vars: dict):
-    model = genai.GenerativeModel(model_name="gemini-1.5-flash")
+model = None
+
+def init_model_client():
+    # Run from the startup warm-up so every worker process builds its own client after fork.
+    # The SDK is imported here, it is the slowest import of the app and not needed to start serving
+    global model
+    if model is None:
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        model = genai.GenerativeModel(model_name=GEMINI_MODEL)
+    return model
+
+def analyze_image(img: "Image", dict_of_vars: dict):
+    model = init_model_client()
     dict_of_vars_str = json.dumps(dict_of_vars, ensure_ascii=False)
     prompt = (
         f"You have been given an image with some mathematical expressions, equations, or graphical problems, and you need to solve them. "
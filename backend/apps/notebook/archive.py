@@ -0,0 +1,166 @@
+import base64
+import json
+import logging
+import mimetypes
+import re
+import zipfile
+from datetime import datetime
+from bson import ObjectId
+from pydantic import ValidationError
+from models.user import NotebookPage
+from db.mongo import get_collection
+from apps.notebook.utils import BUMP_VERSION, page_document
+from constants import ARCHIVE_BATCH_SIZE, ARCHIVE_MAX_ENTRY_BYTES
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_FORMAT = 1
+MANIFEST = "notebook.json"
+PAGE_ENTRY = re.compile(r"^pages/(\d+)\.json$")
+
+
+class ArchiveError(ValueError):
+    pass
+
+
+class _StreamSink:
+    """Write-only file for zipfile. Having tell() but no seek() makes zipfile
+    stream entries with data descriptors, the bytes are handed out by drain()."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def iter_pages(user_id: str):
+    # One page per document off the cursor, never the whole notebook_pages array
+    return get_collection("users").aggregate([
+        {"$match": {"_id": ObjectId(user_id)}},
+        {"$unwind": "$notebook_pages"},
+        {"$replaceRoot": {"newRoot": "$notebook_pages"}},
+    ], batchSize=ARCHIVE_BATCH_SIZE)
+
+
+def split_canvas(canvas_data: str):
+    header, _, encoded = canvas_data.partition(",")  # data:image/png;base64,<data>
+    media_type = header[5:].split(";")[0] if header.startswith("data:") else "image/png"
+    return media_type or "image/png", base64.b64decode(encoded or header)
+
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+
+def export_archive(user_id: str):
+    """Yields a zip of the notebook, one page (JSON plus its canvas as an image file) at a time."""
+    sink = _StreamSink()
+    count = 0
+    with zipfile.ZipFile(sink, mode="w") as archive:
+        for page in iter_pages(user_id):
+            count += 1
+            name = f"pages/{count:05d}"
+            page.pop("_id", None)
+            camel_canvas = page.pop("canvasData", None)
+            canvas_data = page.pop("canvas_data", None) or camel_canvas
+            if canvas_data:
+                try:
+                    media_type, image = split_canvas(canvas_data)
+                    page["canvas"] = name + (mimetypes.guess_extension(media_type) or ".png")
+                    page["canvas_media_type"] = media_type
+                    # Canvases are already compressed
+                    archive.writestr(page["canvas"], image, compress_type=zipfile.ZIP_STORED)
+                except (ValueError, TypeError) as e:
+                    logger.warning(f"Skipping unreadable canvas of page {page.get('id')}: {str(e)}")
+            archive.writestr(name + ".json", json.dumps(page, default=_json_default), compress_type=zipfile.ZIP_DEFLATED)
+            yield sink.drain()
+        # Written last, the page count is only known once the cursor is exhausted
+        manifest = {"format": ARCHIVE_FORMAT, "exported_at": datetime.now().isoformat(), "pages": count}
+        archive.writestr(MANIFEST, json.dumps(manifest))
+    yield sink.drain()
+    logger.info(f"Exported {count} page(s) for user {user_id}")
+
+
+def _read_entry(archive: zipfile.ZipFile, name: str) -> bytes:
+    # Sizes come from the archive itself, refuse entries that would inflate past the limit
+    if archive.getinfo(name).file_size > ARCHIVE_MAX_ENTRY_BYTES:
+        raise ArchiveError(f"{name} is larger than {ARCHIVE_MAX_ENTRY_BYTES} bytes")
+    return archive.read(name)
+
+
+def _read_page(archive: zipfile.ZipFile, name: str) -> dict:
+    page = json.loads(_read_entry(archive, name))
+    if not isinstance(page, dict):
+        raise ArchiveError(f"{name} is not a page")
+    canvas = page.pop("canvas", None)
+    media_type = page.pop("canvas_media_type", None) or "image/png"
+    if canvas:
+        image = _read_entry(archive, canvas)
+        page["canvas_data"] = f"data:{media_type};base64,{base64.b64encode(image).decode()}"
+    return page_document(NotebookPage(**page))
+
+
+def import_archive(user_id: str, fileobj) -> dict:
+    """Appends the pages of an exported archive to the notebook in batches.
+
+    Pages whose id already exists in the notebook are skipped, so importing
+    the same archive twice is harmless.
+    """
+    user_collection = get_collection("users")
+    existing = user_collection.find_one({"_id": ObjectId(user_id)}, {"notebook_pages.id": 1}) or {}
+    seen = {page.get("id") for page in existing.get("notebook_pages", [])}
+    imported, skipped, errors = 0, 0, []
+
+    def flush(batch: list):
+        user_collection.update_one(
+            {"_id": ObjectId(user_id)},
+            {"$push": {"notebook_pages": {"$each": batch}}, "$inc": BUMP_VERSION},
+        )
+        # No thumbnails here: queueing every canvas of a large import would hold them all
+        # in memory, the thumbnail endpoint renders each one the first time it is asked for
+
+    try:
+        with zipfile.ZipFile(fileobj) as archive:
+            names = sorted(
+                (name for name in archive.namelist() if PAGE_ENTRY.match(name)),
+                key=lambda name: int(PAGE_ENTRY.match(name).group(1)),
+            )
+            batch = []
+            for name in names:
+                try:
+                    page = _read_page(archive, name)
+                except (KeyError, ValueError, ValidationError) as e:
+                    errors.append({"entry": name, "error": str(e)})
+                    continue
+                if page["id"] in seen:
+                    skipped += 1
+                    continue
+                seen.add(page["id"])
+                batch.append(page)
+                if len(batch) >= ARCHIVE_BATCH_SIZE:
+                    flush(batch)
+                    imported += len(batch)
+                    batch = []
+            if batch:
+                flush(batch)
+                imported += len(batch)
+    except zipfile.BadZipFile as e:
+        raise ArchiveError(f"Not a notebook archive: {str(e)}")
+
+    logger.info(f"Imported {imported} page(s) for user {user_id}, skipped {skipped}, {len(errors)} error(s)")
+    return {"imported": imported, "skipped": skipped, "errors": errors}
@@ -0,0 +1,194 @@
+import logging
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from db.mongo import get_collection
+from apps.notebook import thumbnails
+from apps.notebook.utils import BUMP_VERSION, page_document
+from apps.notebook.variables import update_graph
+
+logger = logging.getLogger(__name__)
+
+MAX_SLICE = 2 ** 31 - 1  # $slice wants a positive int32 count, this one means "to the end"
+
+
+class InvalidOperation(ValueError):
+    def __init__(self, status: str, error: str):
+        super().__init__(error)
+        self.status = status
+
+
+def _move_pipeline(page_id: str, position: int) -> list:
+    # Takes the page out and splices it back in at `position` within a single update
+    rest = {"$filter": {"input": "$notebook_pages", "cond": {"$ne": ["$$this.id", page_id]}}}
+    page = {"$filter": {"input": "$notebook_pages", "cond": {"$eq": ["$$this.id", page_id]}}}
+    if position == 0:
+        pages = {"$concatArrays": [page, rest]}
+    else:
+        pages = {"$let": {"vars": {"rest": rest}, "in": {"$concatArrays": [
+            {"$slice": ["$$rest", position]},
+            page,
+            {"$slice": ["$$rest", position, MAX_SLICE]},
+        ]}}}
+    return [{"$set": {"notebook_pages": pages, "notebook_version": {"$add": [{"$ifNull": ["$notebook_version", 0]}, 1]}}}]
+
+
+def _plan(user_filter: dict, page_ids: list, operation) -> UpdateOne:
+    """Checks one operation against the page ids as they will be after the previous
+    ones, updates page_ids to match and returns the write for it."""
+    if operation.op == "create":
+        if operation.page is None:
+            raise InvalidOperation("invalid", "create needs a page")
+        page = page_document(operation.page)
+        if page["id"] in page_ids:
+            raise InvalidOperation("conflict", f"Page {page['id']} already exists")
+        page_ids.append(page["id"])
+        # The filter guards against a page with the same id being created concurrently
+        return UpdateOne({**user_filter, "notebook_pages.id": {"$ne": page["id"]}},
+                         {"$push": {"notebook_pages": page}, "$inc": BUMP_VERSION})
+
+    if not operation.id:
+        raise InvalidOperation("invalid", f"{operation.op} needs a page id")
+    if operation.id not in page_ids:
+        raise InvalidOperation("not_found", f"Page {operation.id} not found")
+    page_filter = {**user_filter, "notebook_pages.id": operation.id}
+
+    if operation.op == "update":
+        changes = operation.changes.model_dump(exclude_unset=True) if operation.changes else {}
+        if not changes:
+            raise InvalidOperation("invalid", "update needs changes")
+        return UpdateOne(page_filter, {
+            "$set": {f"notebook_pages.$.{field}": value for field, value in changes.items()},
+            "$inc": BUMP_VERSION,
+        })
+
+    if operation.op == "delete":
+        page_ids.remove(operation.id)
+        return UpdateOne(page_filter, {"$pull": {"notebook_pages": {"id": operation.id}}, "$inc": BUMP_VERSION})
+
+    if operation.position is None or operation.position < 0:
+        raise InvalidOperation("invalid", "move needs a position of 0 or more")
+    position = min(operation.position, len(page_ids) - 1)
+    page_ids.remove(operation.id)
+    page_ids.insert(position, operation.id)
+    return UpdateOne(page_filter, _move_pipeline(operation.id, position))
+
+
+def _check_independent(page_id: str, operation, touched: set, structural: list):
+    """Unordered batches may be applied by Mongo in any order, so no operation in
+    one may depend on another: each page is touched at most once, and a move
+    (whose position depends on every other create, delete and move) comes alone."""
+    if page_id in touched:
+        raise InvalidOperation("invalid", f"Page {page_id} is changed by an earlier operation, which needs ordered=true")
+    if (operation.op == "move" and structural) or (operation.op in ("create", "delete") and "move" in structural):
+        raise InvalidOperation("invalid", "A move cannot be combined with other creates, deletes or moves unless ordered=true")
+
+
+def apply_operations(user_id: str, operations: list, ordered: bool = True) -> dict:
+    """Runs create/update/delete/move operations on a notebook in one bulk_write.
+
+    bulk_write only reports totals, so every operation is first checked against
+    the notebook's page ids (read without the canvases) to give per-operation
+    results; the write filters still catch pages changed concurrently, in which
+    case the operations that ran are reported as unknown.
+    """
+    user_collection = get_collection("users")
+    user_filter = {"_id": ObjectId(user_id)}
+    existing = user_collection.find_one(user_filter, {"notebook_pages.id": 1}) or {}
+    page_ids = [page.get("id") for page in existing.get("notebook_pages", [])]
+
+    results, requests, planned = [], [], []
+    touched, structural = set(), []
+    halted = False
+    for index, operation in enumerate(operations):
+        result = {"index": index, "op": operation.op, "id": operation.page.id if operation.page else operation.id}
+        results.append(result)
+        if halted:
+            result["status"] = "skipped"
+            continue
+        try:
+            if not ordered:
+                _check_independent(result["id"], operation, touched, structural)
+            requests.append(_plan(user_filter, page_ids, operation))
+            planned.append((result, operation))
+            result["status"] = "pending"
+            touched.add(result["id"])
+            if operation.op != "update":
+                structural.append(operation.op)
+        except InvalidOperation as e:
+            result.update({"status": e.status, "error": str(e)})
+            halted = ordered
+
+    matched = 0
+    if requests:
+        try:
+            matched = user_collection.bulk_write(requests, ordered=ordered).matched_count
+            failed = set()
+        except BulkWriteError as e:
+            matched = e.details.get("nMatched", 0)
+            failed = {error["index"] for error in e.details.get("writeErrors", [])}
+            logger.error(f"Bulk page write for user {user_id} failed: {e.details.get('writeErrors')}")
+        executed = []
+        for position, (result, operation) in enumerate(planned):
+            if position in failed:
+                result.update({"status": "failed", "error": "Write failed"})
+            elif ordered and failed and position > min(failed):
+                result["status"] = "skipped"
+            else:
+                result["status"] = "ok"
+                executed.append((result, operation))
+        if matched < len(executed):
+            # Some filters no longer matched: the notebook changed underneath this request.
+            # bulk_write only reports totals, so which operations applied is unknown
+            for result, operation in executed:
+                result.update({"status": "unknown", "error": "The notebook changed during this request, reload it"})
+            _after_uncertain_write(user_filter, user_id, [operation for result, operation in executed])
+        else:
+            _after_write(user_id, [operation for result, operation in executed])
+
+    return {
+        "ordered": ordered,
+        "applied": matched,
+        # Fewer matches than planned writes means the notebook changed underneath this request
+        "conflicts": len(requests) - matched,
+        "results": results,
+    }
+
+
+def _after_write(user_id: str, operations: list):
+    deleted = []
+    for operation in operations:
+        if operation.op == "create":
+            page = operation.page
+            thumbnails.enqueue_thumbnail(user_id, page.id, page.canvas_data or page.canvasData)
+        elif operation.op == "update" and operation.changes and operation.changes.canvas_data:
+            thumbnails.enqueue_thumbnail(user_id, operation.id, operation.changes.canvas_data)
+        elif operation.op == "delete":
+            thumbnails.delete_thumbnail(user_id, operation.id)
+            deleted.append(operation.id)
+    if deleted:
+        _drop_variables(user_id, deleted)
+
+
+def _after_uncertain_write(user_filter: dict, user_id: str, operations: list):
+    # Only clean-up that is right whether or not the operation applied: drop
+    # thumbnails that may be stale (they are rendered again on demand) and the
+    # variables of pages that are gone now
+    existing = get_collection("users").find_one(user_filter, {"notebook_pages.id": 1}) or {}
+    page_ids = {page.get("id") for page in existing.get("notebook_pages", [])}
+    deleted = []
+    for operation in operations:
+        if operation.op == "update" and operation.changes and operation.changes.canvas_data:
+            thumbnails.delete_thumbnail(user_id, operation.id)
+        elif operation.op == "delete" and operation.id not in page_ids:
+            thumbnails.delete_thumbnail(user_id, operation.id)
+            deleted.append(operation.id)
+    if deleted:
+        _drop_variables(user_id, deleted)
+
+
+def _drop_variables(user_id: str, page_ids: list):
+    try:
+        update_graph(user_id, lambda graph: [node for page_id in page_ids for node in graph.remove_page(page_id)])
+    except Exception as e:
+        logger.error(f"Failed to drop variables of deleted pages: {str(e)}")
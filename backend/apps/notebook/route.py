@@ -1,8 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from models.user import NotebookPage
+import asyncio
+from fastapi import APIRouter, Depends, File, HTTPException, Request, Response, UploadFile, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from models.user import BulkPageOperations, NotebookPage, VariableUpdate
 from db.mongo import get_collection
-from apps.auth.utils import get_current_user
+from apps.auth.utils import get_current_user, get_current_user_without_pages
+from apps.notebook import thumbnails
+from apps.notebook.archive import ArchiveError, export_archive, import_archive
+from apps.notebook.bulk import apply_operations
+from apps.notebook.search import search_pages
+from apps.notebook.utils import BUMP_VERSION, get_page, page_exists
+from apps.notebook.variables import IDENTIFIER, load_graph, update_graph
 from typing import List
+from constants import BULK_MAX_OPERATIONS
 from datetime import datetime
 from bson import ObjectId
 
@@ -111,7 +121,7 @@ async def create_page(page: NotebookPage, current_user = Depends(get_current_use
         # Add page to user's notebook_pages array
         result = user_collection.update_one(
             {"_id": ObjectId(current_user["_id"])},
-            {"$push": {"notebook_pages": page_dict}}
+            {"$push": {"notebook_pages": page_dict}, "$inc": BUMP_VERSION}
         )
         print(f"MongoDB update result: matched={result.matched_count}, modified={result.modified_count}")
         
@@ -119,6 +129,9 @@ async def create_page(page: NotebookPage, current_user = Depends(get_current_use
         updated_user = user_collection.find_one({"_id": ObjectId(current_user["_id"])})
         page_count = len(updated_user.get('notebook_pages', []))
         print(f"User now has {page_count} pages")
+
+        # Render the sidebar preview in the background
+        thumbnails.enqueue_thumbnail(str(current_user["_id"]), page_dict["id"], page_dict.get("canvas_data"))
         
         return page_dict
     except Exception as e:
@@ -128,6 +141,20 @@ async def create_page(page: NotebookPage, current_user = Depends(get_current_use
             detail=f"Error creating page: {str(e)}"
         )
 
+@router.post("/pages:bulk")
+async def bulk_pages(bulk: BulkPageOperations, current_user = Depends(get_current_user_without_pages)):
+    if not 1 <= len(bulk.operations) <= BULK_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Send between 1 and {BULK_MAX_OPERATIONS} operations"
+        )
+    # One bulk_write for the whole batch instead of a request per page
+    result = await run_in_threadpool(
+        apply_operations, str(current_user["_id"]), bulk.operations, bulk.ordered
+    )
+    print(f"Bulk page operations: {result['applied']} of {len(bulk.operations)} applied")
+    return result
+
 @router.put("/pages/{page_id}", response_model=NotebookPage)
 async def update_page(page_id: str, updated_page: NotebookPage, current_user = Depends(get_current_user)):
     try:
@@ -170,13 +197,24 @@ async def update_page(page_id: str, updated_page: NotebookPage, current_user = D
                 page_dict["date_created"] = datetime.now()
                 print("Using current datetime for date_created")
         
+        # Solved results are appended server-side by /calculate, clients that do not
+        # send them must not wipe them, so only the fields they own are replaced
+        if "results" in updated_page.model_fields_set:
+            update = {f"notebook_pages.{page_index}": page_dict}
+        else:
+            update = {f"notebook_pages.{page_index}.{key}": value for key, value in page_dict.items() if key != "results"}
+            page_dict["results"] = current_user["notebook_pages"][page_index].get("results", [])
+
         # Update in database
         result = user_collection.update_one(
             {"_id": ObjectId(current_user["_id"])},
-            {"$set": {f"notebook_pages.{page_index}": page_dict}}
+            {"$set": update, "$inc": BUMP_VERSION}
         )
         
         print(f"Update result: matched={result.matched_count}, modified={result.modified_count}")
+
+        # Render the sidebar preview in the background
+        thumbnails.enqueue_thumbnail(str(current_user["_id"]), page_id, page_dict.get("canvas_data"))
         return page_dict
     except Exception as e:
         print(f"Error updating page: {str(e)}")
@@ -190,9 +228,105 @@ async def delete_page(page_id: str, current_user = Depends(get_current_user)):
     user_collection = get_collection("users")
     
     # Remove the page from the user's notebook_pages array
-    user_collection.update_one(
+    await run_in_threadpool(
+        user_collection.update_one,
         {"_id": ObjectId(current_user["_id"])},
-        {"$pull": {"notebook_pages": {"id": page_id}}}
+        {"$pull": {"notebook_pages": {"id": page_id}}, "$inc": BUMP_VERSION}
     )
+    # A render still queued for this page checks that the page exists before and after storing
+    await run_in_threadpool(thumbnails.delete_thumbnail, str(current_user["_id"]), page_id)
+    try:
+        await run_in_threadpool(update_graph, str(current_user["_id"]), lambda graph: graph.remove_page(page_id))
+    except Exception as e:
+        # The page is gone either way, its expressions are dropped on the next re-solve or delete
+        print(f"Error dropping variables of page {page_id}: {str(e)}")
     
-    return None
\ No newline at end of file
+    return None
+
+@router.get("/pages/{page_id}/thumbnail")
+async def get_page_thumbnail(page_id: str, request: Request, current_user = Depends(get_current_user_without_pages)):
+    user_id = str(current_user["_id"])
+    thumbnail, exists = await asyncio.gather(
+        run_in_threadpool(thumbnails.get_thumbnail, user_id, page_id),
+        run_in_threadpool(page_exists, user_id, page_id),
+    )
+    page_not_found = HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Page not found")
+    if not exists:
+        if thumbnail is not None:
+            # Left behind by a render that finished after the page was deleted
+            await run_in_threadpool(thumbnails.delete_thumbnail, user_id, page_id)
+        raise page_not_found
+
+    if thumbnail is None:
+        # Not rendered yet (job still queued or lost on restart), render it now
+        page = await run_in_threadpool(get_page, user_id, page_id)
+        if page is None:
+            raise page_not_found
+        canvas_data = page.get("canvas_data") or page.get("canvasData")
+        if not canvas_data:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Page has no drawing")
+        thumbnail = await run_in_threadpool(thumbnails.render_page_thumbnail, user_id, page_id, canvas_data)
+        if thumbnail is None:
+            raise page_not_found
+
+    # The ETag follows the canvas, so clients revalidate and get a 304 until the page changes
+    etag = f'"{thumbnail["etag"]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    return Response(content=bytes(thumbnail["data"]), media_type=thumbnail["media_type"], headers=headers)
+
+@router.get("/variables")
+async def get_variables(current_user = Depends(get_current_user_without_pages)):
+    graph = await run_in_threadpool(load_graph, str(current_user["_id"]))
+    return {"variables": graph.variables, "expressions": list(graph.expressions.values()), "conflicts": graph.conflicts()}
+
+@router.put("/variables/{name}")
+async def set_variable(name: str, update: VariableUpdate, current_user = Depends(get_current_user_without_pages)):
+    if not IDENTIFIER.match(name):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Variable names must be identifiers"
+        )
+    # Dependent expressions are recomputed from their cached transcriptions, no model call
+    graph, updated = await run_in_threadpool(
+        update_graph, str(current_user["_id"]), lambda graph: graph.set_variable(name, update.value)
+    )
+    print(f"Variable {name} set, {len(updated)} dependent expression(s) recomputed")
+    return {"variables": graph.variables, "updated": updated}
+
+@router.get("/search")
+async def search(q: str, limit: int = 20, offset: int = 0, current_user = Depends(get_current_user_without_pages)):
+    if not 1 <= limit <= 100 or offset < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="limit must be between 1 and 100 and offset must not be negative"
+        )
+    # The user document comes without pages, its notebook_version says whether the cached index is current
+    total, results = await run_in_threadpool(
+        search_pages, str(current_user["_id"]), current_user.get("notebook_version", 0), q, limit, offset
+    )
+    print(f"Search '{q}' matched {total} page(s)")
+    return {"query": q, "total": total, "limit": limit, "offset": offset, "results": results}
+
+@router.get("/export")
+async def export_notebook(current_user = Depends(get_current_user_without_pages)):
+    # Pages are read off a cursor and zipped one at a time, the sync generator runs in the threadpool
+    filename = f"notebook-{datetime.now().strftime('%Y%m%d-%H%M%S')}.zip"
+    return StreamingResponse(
+        export_archive(str(current_user["_id"])),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@router.post("/import")
+async def import_notebook(archive: UploadFile = File(...), current_user = Depends(get_current_user_without_pages)):
+    # The upload is spooled to disk by the multipart parser, entries are read from it page by page
+    try:
+        result = await run_in_threadpool(import_archive, str(current_user["_id"]), archive.file)
+    except ArchiveError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        await archive.close()
+    print(f"Imported {result['imported']} page(s), skipped {result['skipped']}")
+    return result
@@ -0,0 +1,133 @@
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import datetime
+from bson import ObjectId
+from db.mongo import get_collection
+
+# Where a term was found decides how much it counts
+FIELD_WEIGHTS = {"name": 4.0, "expr": 2.0, "result": 1.0, "content": 1.0}
+EXACT_MATCH_BONUS = 1.5
+
+TOKEN = re.compile(r"[a-z0-9]+(?:\.[0-9]+)?")
+
+
+def tokenize(text) -> list:
+    # LaTeX commands tokenize to their names, so "\frac{x}{2}" yields frac, x, 2
+    return TOKEN.findall(str(text).lower())
+
+
+class PageIndex:
+    """Inverted index over one notebook's page names and solved expressions.
+
+    Terms are kept sorted so a query term matches every indexed term it
+    prefixes with a binary search instead of a scan.
+    """
+
+    def __init__(self, pages: list):
+        self.pages = {}
+        postings = {}
+        for page in pages:
+            page_id = page.get("id")
+            if not page_id:
+                continue
+            # Keep only what results need, not the canvases
+            self.pages[page_id] = {
+                "name": page.get("name"),
+                "date_created": page.get("date_created"),
+                "expressions": [result.get("expr") for result in page.get("results") or []],
+            }
+            for field, text in self._fields(page):
+                for term in tokenize(text):
+                    weights = postings.setdefault(term, {})
+                    weights[page_id] = max(weights.get(page_id, 0.0), FIELD_WEIGHTS[field])
+        self.terms = sorted(postings)
+        self.postings = postings
+
+    @staticmethod
+    def _fields(page: dict):
+        yield "name", page.get("name", "")
+        for result in page.get("results") or []:
+            yield "expr", result.get("expr", "")
+            yield "result", result.get("result", "")
+        for item in page.get("content") or []:
+            yield "content", " ".join(str(value) for value in item.values())
+
+    def _prefix_matches(self, prefix: str):
+        start = bisect_left(self.terms, prefix)
+        for term in self.terms[start:]:
+            if not term.startswith(prefix):
+                break
+            yield term
+
+    def search(self, query: str) -> list:
+        query_terms = tokenize(query)
+        if not query_terms:
+            return []
+        scores = None
+        for query_term in query_terms:
+            term_scores = {}
+            for term in self._prefix_matches(query_term):
+                bonus = EXACT_MATCH_BONUS if term == query_term else 1.0
+                for page_id, weight in self.postings[term].items():
+                    term_scores[page_id] = max(term_scores.get(page_id, 0.0), weight * bonus)
+            # Every query term has to match somewhere on the page
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {page_id: score + term_scores[page_id] for page_id, score in scores.items() if page_id in term_scores}
+            if not scores:
+                return []
+        return sorted(scores.items(), key=lambda item: (-item[1], self._sort_date(item[0])))
+
+    def _sort_date(self, page_id: str) -> float:
+        # Newer pages first among equal scores
+        created = self.pages[page_id].get("date_created")
+        return -created.timestamp() if isinstance(created, datetime) else 0.0
+
+
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+MAX_CACHED_INDEXES = 256
+
+# Only the page fields the index reads, never the canvases
+INDEXED_FIELDS = {"notebook_version": 1, **{
+    f"notebook_pages.{field}": 1 for field in ("id", "name", "date_created", "results", "content")
+}}
+
+
+def get_index(user_id: str, version: int) -> PageIndex:
+    # Rebuilt only when a page write has bumped notebook_version
+    with _indexes_lock:
+        cached = _indexes.get(user_id)
+        if cached is not None and cached[0] == version:
+            _indexes.move_to_end(user_id)
+            return cached[1]
+    user = get_collection("users").find_one({"_id": ObjectId(user_id)}, INDEXED_FIELDS) or {}
+    # Cached under the version read together with the pages, which may be newer
+    index = PageIndex(user.get("notebook_pages", []))
+    with _indexes_lock:
+        _indexes[user_id] = (user.get("notebook_version", 0), index)
+        _indexes.move_to_end(user_id)
+        while len(_indexes) > MAX_CACHED_INDEXES:
+            _indexes.popitem(last=False)
+    return index
+
+
+def search_pages(user_id: str, version: int, query: str, limit: int, offset: int):
+    """Blocking: may read the pages from Mongo and rebuild the index, run it in the threadpool."""
+    index = get_index(user_id, version)
+    ranked = index.search(query)
+    results = []
+    for page_id, score in ranked[offset:offset + limit]:
+        page = index.pages[page_id]
+        created = page.get("date_created")
+        results.append({
+            "id": page_id,
+            "name": page.get("name"),
+            "date_created": created.isoformat() if isinstance(created, datetime) else created,
+            "score": round(score, 3),
+            "expressions": page["expressions"],
+        })
+    return len(ranked), results
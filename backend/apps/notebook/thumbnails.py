@@ -0,0 +1,116 @@
+import base64
+import hashlib
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
+from bson import Binary
+from pymongo.errors import DuplicateKeyError
+from db.mongo import get_collection
+from apps.notebook.utils import page_exists
+from constants import THUMBNAIL_SIZE, THUMBNAIL_FORMAT, THUMBNAIL_WORKERS
+
+logger = logging.getLogger(__name__)
+
+# Pillow releases the GIL while decoding and resampling, so threads are enough
+# and the canvases do not have to be pickled over to another process
+executor = ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS, thread_name_prefix="thumbnail")
+
+
+@lru_cache(maxsize=None)
+def output_format():
+    # Pillow is imported on first use, not when the app starts
+    from PIL import features
+    if THUMBNAIL_FORMAT.upper() == "WEBP" and features.check("webp"):
+        return "WEBP", "image/webp"
+    return "PNG", "image/png"
+
+
+def thumbnail_id(user_id: str, page_id: str) -> str:
+    return f"{user_id}:{page_id}"
+
+
+def canvas_etag(canvas_data: str) -> str:
+    return hashlib.sha1(canvas_data.encode()).hexdigest()
+
+
+def render_thumbnail(canvas_data: str) -> bytes:
+    from PIL import Image
+    raw = base64.b64decode(canvas_data.split(",")[-1])  # data:image/png;base64,<data>
+    image = Image.open(BytesIO(raw))
+    image.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+    output = BytesIO()
+    image_format = output_format()[0]
+    if image_format == "WEBP":
+        image.save(output, image_format, quality=80, method=4)
+    else:
+        image.save(output, image_format, optimize=True)
+    return output.getvalue()
+
+
+def store_thumbnail(user_id: str, page_id: str, canvas_data: str, version: int = None):
+    version = version or time.time_ns()
+    document = {
+        "user_id": user_id,
+        "page_id": page_id,
+        "data": Binary(render_thumbnail(canvas_data)),
+        "media_type": output_format()[1],
+        "etag": canvas_etag(canvas_data),
+        "version": version,
+        "updated_at": datetime.now(),
+    }
+    try:
+        # Only overwrite older renders, two quick saves may finish out of order
+        get_collection("page_thumbnails").update_one(
+            {"_id": thumbnail_id(user_id, page_id), "version": {"$lt": version}},
+            {"$set": document},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        logger.info(f"Skipping stale thumbnail for page {page_id}")
+    return document
+
+
+def render_page_thumbnail(user_id: str, page_id: str, canvas_data: str, version: int = None):
+    """Stores the thumbnail only while the page exists. A page deleted while its
+    render was queued or running would otherwise keep a thumbnail forever, so the
+    page is checked again once the thumbnail is stored. Returns None for deleted pages."""
+    if not page_exists(user_id, page_id):
+        delete_thumbnail(user_id, page_id)
+        return None
+    document = store_thumbnail(user_id, page_id, canvas_data, version)
+    if not page_exists(user_id, page_id):
+        delete_thumbnail(user_id, page_id)
+        return None
+    return document
+
+
+def delete_thumbnail(user_id: str, page_id: str):
+    get_collection("page_thumbnails").delete_one({"_id": thumbnail_id(user_id, page_id)})
+
+
+def get_thumbnail(user_id: str, page_id: str):
+    return get_collection("page_thumbnails").find_one({"_id": thumbnail_id(user_id, page_id)})
+
+
+def _log_failure(page_id: str):
+    def callback(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Thumbnail job for page {page_id} failed: {str(future.exception())}")
+    return callback
+
+
+def enqueue_thumbnail(user_id: str, page_id: str, canvas_data: str):
+    # The version is taken at save time so the latest save wins regardless of job order
+    if canvas_data:
+        future = executor.submit(render_page_thumbnail, user_id, page_id, canvas_data, time.time_ns())
+    else:
+        future = executor.submit(delete_thumbnail, user_id, page_id)
+    future.add_done_callback(_log_failure(page_id))
+
+
+def shutdown():
+    # Queued jobs are dropped, the thumbnail endpoint renders missing ones on demand
+    executor.shutdown(wait=True, cancel_futures=True)
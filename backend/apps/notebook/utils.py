@@ -0,0 +1,86 @@
+from datetime import datetime
+from bson import ObjectId
+from db.mongo import get_collection
+
+# Every write to notebook_pages bumps notebook_version, so caches built from
+# the pages (e.g. the search index) know when they are stale
+BUMP_VERSION = {"notebook_version": 1}
+
+
+def get_page(user_id: str, page_id: str):
+    # Only the matching page comes back from Mongo, not every canvas in the notebook
+    user = get_collection("users").find_one(
+        {"_id": ObjectId(user_id)}, {"notebook_pages": {"$elemMatch": {"id": page_id}}}
+    )
+    pages = user.get("notebook_pages") if user else None
+    return pages[0] if pages else None
+
+
+def page_exists(user_id: str, page_id: str) -> bool:
+    return get_collection("users").find_one(
+        {"_id": ObjectId(user_id), "notebook_pages.id": page_id}, {"_id": 1}
+    ) is not None
+
+
+def save_page_results(user_id: str, page_id: str, results: list) -> bool:
+    """Returns False when the notebook has no such page, e.g. an unsaved canvas."""
+    # The latest solve replaces the page's results, re-solving never accumulates duplicates
+    return get_collection("users").update_one(
+        {"_id": ObjectId(user_id), "notebook_pages.id": page_id},
+        {"$set": {"notebook_pages.$.results": results}, "$inc": BUMP_VERSION},
+    ).matched_count == 1
+
+
+def write_back_results(user_id: str, nodes: list, attempts: int = 3):
+    """Copies recomputed expression values into the results stored on their pages.
+
+    Only results and page ids are read, and notebook_version pins the page
+    positions written to, so a concurrent page write makes this retry rather than
+    overwrite the wrong page.
+    """
+    values = {}
+    for node in nodes:
+        values.setdefault(node["page_id"], {})[node["expr"]] = node["result"]
+    if not values:
+        return
+    user_collection = get_collection("users")
+    for _ in range(attempts):
+        user = user_collection.find_one(
+            {"_id": ObjectId(user_id)}, {"notebook_version": 1, "notebook_pages.id": 1, "notebook_pages.results": 1}
+        )
+        if user is None:
+            return
+        changes = {}
+        for index, page in enumerate(user.get("notebook_pages", [])):
+            page_values = values.get(page.get("id"))
+            if not page_values or not page.get("results"):
+                continue
+            results = [
+                {**result, "result": page_values[str(result.get("expr", "")).strip()]}
+                if str(result.get("expr", "")).strip() in page_values else result
+                for result in page["results"]
+            ]
+            if results != page["results"]:
+                changes[f"notebook_pages.{index}.results"] = results
+        if not changes:
+            return
+        version = user["notebook_version"] if "notebook_version" in user else {"$exists": False}
+        matched = user_collection.update_one(
+            {"_id": ObjectId(user_id), "notebook_version": version},
+            {"$set": changes, "$inc": BUMP_VERSION},
+        ).matched_count
+        if matched:
+            return
+    raise RuntimeError("Notebook pages are being updated too frequently")
+
+
+def page_document(page) -> dict:
+    # NotebookPage.model_dump() turns dates into strings, Mongo should store datetimes
+    page_dict = page.model_dump()
+    camel_canvas = page_dict.pop("canvasData", None)
+    page_dict["canvas_data"] = page_dict.get("canvas_data") or camel_canvas
+    try:
+        page_dict["date_created"] = datetime.fromisoformat(page_dict["date_created"].replace("Z", "+00:00"))
+    except (AttributeError, ValueError):
+        page_dict["date_created"] = datetime.now()
+    return page_dict
@@ -0,0 +1,365 @@
+import ast
+import hashlib
+import logging
+import math
+import operator
+import re
+from collections import deque
+from functools import lru_cache
+from pymongo.errors import DuplicateKeyError
+from db.mongo import get_collection
+from apps.notebook.utils import write_back_results
+
+logger = logging.getLogger(__name__)
+
+IDENTIFIER = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+FUNCTIONS = {
+    "sin": math.sin, "cos": math.cos, "tan": math.tan,
+    "sqrt": math.sqrt, "log": math.log10, "ln": math.log, "exp": math.exp, "abs": abs,
+}
+CONSTANTS = {"pi": math.pi, "e": math.e}
+BINARY_OPERATORS = {
+    ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+    ast.Div: operator.truediv, ast.Pow: operator.pow, ast.Mod: operator.mod,
+}
+UNARY_OPERATORS = {ast.UAdd: operator.pos, ast.USub: operator.neg}
+
+_LATEX_REPLACEMENTS = [
+    ("\\left", ""), ("\\right", ""), ("\\cdot", "*"), ("\\times", "*"), ("\\div", "/"),
+    ("\\,", ""), ("\\ ", ""), ("$", ""), ("^", "**"),
+]
+_FRAC = re.compile(r"\\frac\s*\{([^{}]*)\}\s*\{([^{}]*)\}")
+_SQRT = re.compile(r"\\sqrt\s*\{([^{}]*)\}")
+_TEXT = re.compile(r"\\(?:text|mathrm|mathit|operatorname)\s*\{\s*([A-Za-z_][A-Za-z0-9_]*)\s*\}")
+_NUMBER = r"\d+(?:\.\d+)?(?:[eE][+-]?\d+)?"
+# The lookahead stops "2e3" backtracking to "2" followed by a variable e3
+_NUMBER_BEFORE_NAME = re.compile(r"(?<![A-Za-z0-9_.])(" + _NUMBER + r")(?![eE][+-]?\d)\s*(?=[A-Za-z(])")
+_LETTERS = re.compile(r"(?<![A-Za-z0-9_.])[A-Za-z]{2,}(?![A-Za-z0-9_])")
+_JUXTAPOSED = re.compile(r"\b([A-Za-z_][A-Za-z0-9_]*|" + _NUMBER + r")\s+(?=[A-Za-z_(0-9])")
+
+
+def latex_to_python(expr: str, names: frozenset = frozenset()) -> str:
+    """Rewrites a transcription as a Python expression. Runs of letters are products
+    of single-letter variables (xy is x*y), as in handwritten maths, unless the run is
+    a function, a constant, one of `names` or written as \\text{name}."""
+    text = expr
+    protected = set(_TEXT.findall(text))
+    text = _TEXT.sub(r"\1", text)
+    for latex, python in _LATEX_REPLACEMENTS:
+        text = text.replace(latex, python)
+    # Innermost first, so nested fractions and roots unwind one level per pass
+    while True:
+        replaced = _SQRT.sub(r"sqrt(\1)", _FRAC.sub(r"((\1)/(\2))", text))
+        if replaced == text:
+            break
+        text = replaced
+    text = re.sub(r"\\([A-Za-z]+)", r"\1", text)  # \sin -> sin, \pi -> pi
+    text = text.replace("{", "(").replace("}", ")").replace("[", "(").replace("]", ")")
+    # Implicit multiplication: 2x, 2(x+1), 1.5e3x, (a)(b), (a)x. A name directly followed
+    # by "(" stays a call: f(x) is not f*(x), and unknown functions are left to the model
+    text = _NUMBER_BEFORE_NAME.sub(r"\1*", text)
+    keep = names | protected
+    text = _LETTERS.sub(
+        lambda m: m.group(0) if m.group(0) in FUNCTIONS or m.group(0) in CONSTANTS or m.group(0) in keep
+        else "*".join(m.group(0)),
+        text,
+    )
+    text = re.sub(r"\)\s*([A-Za-z0-9(])", r")*\1", text)
+    # Juxtaposed names like "\pi x" (but "\sin x" is a call, not a product)
+    text = _JUXTAPOSED.sub(lambda m: m.group(1) + (" " if m.group(1) in FUNCTIONS else "*"), text)
+    text = re.sub(r"\b(" + "|".join(FUNCTIONS) + r") ([A-Za-z0-9_.]+)", r"\1(\2)", text)
+    return text
+
+
+class Formula:
+    """A transcription the model returned, parsed once so it can be re-evaluated locally."""
+
+    def __init__(self, tree: ast.AST, target):
+        self.tree = tree
+        self.target = target
+        self.dependencies = frozenset(
+            node.id for node in ast.walk(tree)
+            if isinstance(node, ast.Name) and node.id not in FUNCTIONS and node.id not in CONSTANTS
+        )
+
+
+def _validate(node: ast.AST):
+    if isinstance(node, ast.Expression):
+        return _validate(node.body)
+    if isinstance(node, ast.Constant):
+        if not isinstance(node.value, (int, float)):
+            raise ValueError("Only numeric constants are supported")
+        return
+    if isinstance(node, ast.Name):
+        return
+    if isinstance(node, ast.BinOp) and type(node.op) in BINARY_OPERATORS:
+        _validate(node.left)
+        return _validate(node.right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in UNARY_OPERATORS:
+        return _validate(node.operand)
+    if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in FUNCTIONS:
+        if node.keywords or len(node.args) != 1:
+            raise ValueError("Functions take exactly one argument")
+        return _validate(node.args[0])
+    raise ValueError(f"Unsupported syntax: {type(node).__name__}")
+
+
+@lru_cache(maxsize=4096)
+def compile_formula(expr: str, names: frozenset = frozenset()):
+    """Returns a Formula for arithmetic expressions and `name = expression`
+    definitions, or None for anything that cannot be evaluated locally.
+    `names` are the multi-letter variables the notebook knows, see latex_to_python."""
+    target = None
+    text = str(expr)
+    if text.count("=") == 1:
+        left, right = (part.strip() for part in text.split("="))
+        if not IDENTIFIER.match(left):
+            return None  # an equation to solve, only the model can do that
+        target, text = left, right
+    try:
+        tree = ast.parse(latex_to_python(text, names), mode="eval")
+        _validate(tree)
+    except (SyntaxError, ValueError):
+        return None
+    return Formula(tree.body, target)
+
+
+def evaluate(node: ast.AST, variables: dict) -> float:
+    # Floats throughout: a runaway power raises OverflowError instead of building a huge int
+    if isinstance(node, ast.Constant):
+        return float(node.value)
+    if isinstance(node, ast.Name):
+        if node.id in variables:
+            return float(variables[node.id])
+        return CONSTANTS[node.id]
+    if isinstance(node, ast.BinOp):
+        return BINARY_OPERATORS[type(node.op)](evaluate(node.left, variables), evaluate(node.right, variables))
+    if isinstance(node, ast.UnaryOp):
+        return UNARY_OPERATORS[type(node.op)](evaluate(node.operand, variables))
+    return FUNCTIONS[node.func.id](evaluate(node.args[0], variables))
+
+
+def as_number(value):
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return value
+    if math.isfinite(number) and number == int(number):
+        return int(number)
+    return number
+
+
+class VariableGraph:
+    """Variables of one notebook plus every cached expression that reads them.
+
+    Changing a variable re-evaluates only the expressions that depend on it,
+    following `y = ...` definitions transitively, without calling the model.
+    """
+
+    def __init__(self, user_id: str, variables: dict = None, expressions: list = None, version: int = 0):
+        self.user_id = user_id
+        self.version = version
+        self.variables = dict(variables or {})
+        self.expressions = {}
+        self.dependents = {}
+        self.names = frozenset()
+        for expression in expressions or []:
+            self._add_expression(expression)
+        self._refresh_names()
+
+    def _formula(self, node: dict):
+        return compile_formula(node["expr"], self.names)
+
+    def _refresh_names(self):
+        """Multi-letter variables are read whole rather than as products of letters, so
+        when one appears or goes away every expression's dependencies are indexed again."""
+        targets = (node.get("target") for node in self.expressions.values())
+        names = frozenset(name for name in (*self.variables, *targets) if name and len(name) > 1)
+        if names == self.names:
+            return
+        self.names = names
+        self.dependents = {}
+        for node_id, node in self.expressions.items():
+            formula = None if node.get("assign") else self._formula(node)
+            for name in formula.dependencies if formula else ():
+                self.dependents.setdefault(name, set()).add(node_id)
+
+    def _add_expression(self, expression: dict):
+        if expression.get("assign"):
+            # A value the model assigned directly (x = 4): defines its target, reads nothing
+            self.expressions[expression["id"]] = dict(expression)
+            return True
+        formula = compile_formula(expression["expr"], self.names)
+        if formula is None or not (formula.dependencies or formula.target):
+            return False
+        node = dict(expression)
+        self.expressions[node["id"]] = node
+        for name in formula.dependencies:
+            self.dependents.setdefault(name, set()).add(node["id"])
+        return True
+
+    def record_results(self, page_id: str, results: list) -> list:
+        # A re-solved page replaces its previous transcriptions rather than adding to them
+        removed = self.remove_page(page_id)
+        changed = set()
+        for result in results:
+            expr = str(result.get("expr", "")).strip()
+            value = as_number(result.get("result"))
+            if result.get("assign") and IDENTIFIER.match(expr):
+                # Kept as a node of the page, so re-solving or deleting the page takes it back
+                self._add_expression({"id": f"{page_id}:={expr}", "page_id": page_id, "expr": expr,
+                                      "result": value, "target": expr, "assign": True})
+                continue
+            node_id = f"{page_id}:{hashlib.sha1(expr.encode()).hexdigest()[:12]}"
+            formula = compile_formula(expr, self.names)
+            self._add_expression({"id": node_id, "page_id": page_id, "expr": expr, "result": value,
+                                  "target": formula.target if formula else None})
+        conflicts = self.conflicts()
+        for node in self.expressions.values():
+            target = node.get("target")
+            if node["page_id"] == page_id and target and target not in conflicts:
+                self.variables[target] = node["result"]
+                changed.add(target)
+        updated = {node["id"]: node for node in removed}
+        updated.update((node["id"], node) for node in self._propagate(changed))
+        return list(updated.values())
+
+    def conflicts(self) -> dict:
+        """Variables defined by more than one expression, with the expressions defining them."""
+        definers = {}
+        for node in self.expressions.values():
+            if node.get("target"):
+                definers.setdefault(node["target"], []).append({"page_id": node["page_id"], "expr": node["expr"]})
+        return {name: nodes for name, nodes in definers.items() if len(nodes) > 1}
+
+    def remove_page(self, page_id: str):
+        conflicts = self.conflicts()
+        removed = [node for node in self.expressions.values() if node["page_id"] == page_id]
+        for node in removed:
+            del self.expressions[node["id"]]
+            for dependents in self.dependents.values():
+                dependents.discard(node["id"])
+        defined = {node.get("target") for node in self.expressions.values()}
+        for node in removed:
+            # Variables only this page defined go with it
+            if node.get("target") and node["target"] not in defined:
+                self.variables.pop(node["target"], None)
+        # A conflict this page was part of may be resolved now, the remaining definition applies
+        changed = set()
+        for name in set(conflicts) - set(self.conflicts()):
+            node = next((node for node in self.expressions.values() if node.get("target") == name), None)
+            if node is None:
+                continue
+            formula = None if node.get("assign") else self._formula(node)
+            if formula is not None and formula.dependencies:
+                changed |= formula.dependencies  # re-evaluates the definition with the current values
+            else:
+                self.variables[name] = node["result"]
+                changed.add(name)
+        return self._propagate(changed)
+
+    def set_variable(self, name: str, value) -> list:
+        self.variables[name] = as_number(value)
+        return self._propagate({name})
+
+    def _propagate(self, changed: set) -> list:
+        # Everything downstream of the changed variables, following `y = ...` definitions.
+        # A variable with several definitions has no single value, nothing reading it is recomputed
+        self._refresh_names()
+        conflicts = self.conflicts()
+        affected = set()
+        seen = set(changed)
+        frontier = deque(changed)
+        while frontier:
+            name = frontier.popleft()
+            if name in conflicts:
+                continue
+            for node_id in self.dependents.get(name, ()):
+                if node_id in affected or self.expressions[node_id].get("target") in conflicts:
+                    continue
+                affected.add(node_id)
+                target = self._formula(self.expressions[node_id]).target
+                if target and target not in seen:
+                    seen.add(target)
+                    frontier.append(target)
+
+        # Topological order so every expression is evaluated once, after the
+        # definitions it reads. Nodes caught in a cycle (x = y + 1, y = x + 1) are skipped.
+        formulas = {node_id: self._formula(self.expressions[node_id]) for node_id in affected}
+        definers = {}
+        for node_id, formula in formulas.items():
+            if formula.target:
+                definers.setdefault(formula.target, []).append(node_id)
+        readers = {node_id: [] for node_id in affected}
+        pending = {node_id: 0 for node_id in affected}
+        for node_id, formula in formulas.items():
+            for name in formula.dependencies:
+                for definer in definers.get(name, ()):
+                    readers[definer].append(node_id)
+                    pending[node_id] += 1
+        ready = deque(node_id for node_id, count in pending.items() if count == 0)
+
+        updated = []
+        while ready:
+            node_id = ready.popleft()
+            for reader in readers[node_id]:
+                pending[reader] -= 1
+                if pending[reader] == 0:
+                    ready.append(reader)
+            node = self.expressions[node_id]
+            formula = formulas[node_id]
+            try:
+                value = as_number(evaluate(formula.tree, self.variables))
+            except (KeyError, TypeError, ValueError, ArithmeticError):
+                continue  # still waiting on a variable, or not numeric
+            if formula.target:
+                self.variables[formula.target] = value
+            if value != node["result"]:
+                node["result"] = value
+                updated.append(node)
+        return updated
+
+    def to_document(self) -> dict:
+        return {
+            "_id": self.user_id,
+            "version": self.version,
+            "variables": self.variables,
+            "expressions": list(self.expressions.values()),
+        }
+
+
+def load_graph(user_id: str) -> VariableGraph:
+    document = get_collection("variable_graphs").find_one({"_id": user_id})
+    if document is None:
+        return VariableGraph(user_id)
+    return VariableGraph(user_id, document.get("variables"), document.get("expressions"), document.get("version", 0))
+
+
+def update_graph(user_id: str, change, attempts: int = 3):
+    """Applies change(graph) and saves it, retrying if another request saved first.
+    Expression values it recomputed are copied into the pages' stored results."""
+    collection = get_collection("variable_graphs")
+    for _ in range(attempts):
+        graph = load_graph(user_id)
+        version = graph.version
+        updated = change(graph)
+        graph.version = version + 1
+        document = graph.to_document()
+        if version == 0:
+            try:
+                collection.insert_one(document)
+                saved = True
+            except DuplicateKeyError:
+                saved = False
+        else:
+            saved = collection.replace_one({"_id": user_id, "version": version}, document).matched_count == 1
+        if saved:
+            try:
+                write_back_results(user_id, updated or [])
+            except Exception as e:
+                # The graph holds the new values, the pages catch up on their next change
+                logger.error(f"Failed to write recomputed results back to pages for {user_id}: {str(e)}")
+            return graph, updated
+        logger.info(f"Variable graph for {user_id} changed concurrently, retrying")
+    raise RuntimeError("Variable graph is being updated too frequently")
@@ -2,15 +2,102 @@ from dotenv import load_dotenv
 import os
 load_dotenv()
 
-SERVER_URL = 'localhost'
-PORT = '8900'
-ENV = 'dev'
+ENV = os.getenv("ENV", "dev")
+IS_DEV = ENV in ("dev", "development")
+SERVER_URL = os.getenv("SERVER_URL", "localhost" if IS_DEV else "0.0.0.0")
+PORT = os.getenv("PORT", "8900")
+
+def available_cpus() -> int:
+    # The CPUs this process may run on, which respects cpusets in containers unlike os.cpu_count().
+    # CFS quotas (docker --cpus) are not visible here, set WEB_CONCURRENCY explicitly for those
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0)) or 1
+    return os.cpu_count() or 1
+
+# Production server settings (ignored in dev, which runs a single reloading process)
+# Default to one worker per core: bcrypt, base64 decoding and PIL are CPU-bound
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1" if IS_DEV else str(available_cpus())))
+KEEP_ALIVE_TIMEOUT = int(os.getenv("KEEP_ALIVE_TIMEOUT", "75"))  # keep above the load balancer idle timeout
+BACKLOG = int(os.getenv("BACKLOG", "2048"))
+LIMIT_CONCURRENCY = int(os.getenv("LIMIT_CONCURRENCY", "0")) or None  # 0 = unlimited
+# One shutdown budget (gunicorn's graceful_timeout): in-flight HTTP calls are drained
+# first, queued calculation jobs get what is left minus a margin to close the clients
+GRACEFUL_SHUTDOWN_TIMEOUT = int(os.getenv("GRACEFUL_SHUTDOWN_TIMEOUT", "30"))
+HTTP_DRAIN_TIMEOUT = int(os.getenv("HTTP_DRAIN_TIMEOUT", str(GRACEFUL_SHUTDOWN_TIMEOUT // 2)))
+JOB_DRAIN_TIMEOUT = max(0, GRACEFUL_SHUTDOWN_TIMEOUT - HTTP_DRAIN_TIMEOUT - 5)
+# gunicorn restarts a worker whose heartbeat stops for this long (gunicorn.conf.py only)
+WORKER_TIMEOUT = int(os.getenv("WORKER_TIMEOUT", "120"))
+FORWARDED_ALLOW_IPS = os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1")
+# Startup warm-up (Mongo pool, indexes, model client) runs after the worker starts serving
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))
+# /readyz probes: cached for HEALTH_CACHE_SECONDS, each one given HEALTH_PROBE_TIMEOUT seconds
+HEALTH_CACHE_SECONDS = float(os.getenv("HEALTH_CACHE_SECONDS", "2"))
+HEALTH_PROBE_TIMEOUT = float(os.getenv("HEALTH_PROBE_TIMEOUT", "2"))
+HEALTH_DB_DEGRADED_MS = float(os.getenv("HEALTH_DB_DEGRADED_MS", "100"))
+HEALTH_LOOP_LAG_DEGRADED_MS = float(os.getenv("HEALTH_LOOP_LAG_DEGRADED_MS", "100"))
+HEALTH_LOOP_LAG_UNAVAILABLE_MS = float(os.getenv("HEALTH_LOOP_LAG_UNAVAILABLE_MS", "1000"))
+# Event-loop monitor: lag sampled every LOOP_MONITOR_INTERVAL seconds, stacks captured for
+# anything blocking the loop longer than LOOP_BLOCK_THRESHOLD seconds
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "true").lower() == "true"
+LOOP_MONITOR_INTERVAL = float(os.getenv("LOOP_MONITOR_INTERVAL", "0.1"))
+LOOP_BLOCK_THRESHOLD = float(os.getenv("LOOP_BLOCK_THRESHOLD", "0.1"))
+# /debug/* endpoints expose stack traces, only enable them in production behind auth or for load tests
+DEBUG_ENDPOINTS = os.getenv("DEBUG_ENDPOINTS", "true" if IS_DEV else "false").lower() == "true"
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
 # Add MongoDB connection string
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
 # JWT settings
 # Generate a secure key if one is not provided in the environment
 SECRET_KEY = os.getenv("SECRET_KEY", "inkquiry-secure-jwt-key-2025-06-16")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
\ No newline at end of file
+ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
+
+# Rate limiting: token buckets per user (JWT subject) or per IP for anonymous callers
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # "memory" (per worker) or "mongo" (shared)
+RATE_LIMIT_MODEL_BURST = float(os.getenv("RATE_LIMIT_MODEL_BURST", "5"))
+RATE_LIMIT_MODEL_PER_MINUTE = float(os.getenv("RATE_LIMIT_MODEL_PER_MINUTE", "20"))
+RATE_LIMIT_DEFAULT_BURST = float(os.getenv("RATE_LIMIT_DEFAULT_BURST", "60"))
+RATE_LIMIT_DEFAULT_PER_MINUTE = float(os.getenv("RATE_LIMIT_DEFAULT_PER_MINUTE", "600"))
+# Per-IP buckets are this many times larger so users behind one NAT are not lumped together
+RATE_LIMIT_IP_MULTIPLIER = float(os.getenv("RATE_LIMIT_IP_MULTIPLIER", "4"))
+# Inference admission: concurrent model calls per worker and queued calls per client
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", "8"))
+INFERENCE_MAX_QUEUED_PER_CLIENT = int(os.getenv("INFERENCE_MAX_QUEUED_PER_CLIENT", "2"))
+# Queued model calls at which /readyz reports the worker unavailable (degraded from half of it)
+HEALTH_MAX_QUEUED = int(os.getenv("HEALTH_MAX_QUEUED", str(INFERENCE_CONCURRENCY * 4)))
+
+# Inference backends, tried in order: "gemini" and "stub" (canned local answer, never fails)
+INFERENCE_BACKENDS = [name.strip() for name in os.getenv("INFERENCE_BACKENDS", "gemini,stub").split(",") if name.strip()]
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "30"))
+STUB_TIMEOUT = float(os.getenv("STUB_TIMEOUT", "2"))
+# Hedged requests: fire a second attempt once a call outlives the backend's p95 latency
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "true").lower() == "true"
+HEDGE_MIN_DELAY = float(os.getenv("HEDGE_MIN_DELAY", "0.5"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_MAX_INFLIGHT = int(os.getenv("HEDGE_MAX_INFLIGHT", "2"))  # caps extra load on a degraded backend
+# Circuit breaker: stop calling a backend whose recent error rate is too high
+CIRCUIT_ERROR_THRESHOLD = float(os.getenv("CIRCUIT_ERROR_THRESHOLD", "0.5"))
+CIRCUIT_MIN_REQUESTS = int(os.getenv("CIRCUIT_MIN_REQUESTS", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_COOLDOWN_SECONDS = float(os.getenv("CIRCUIT_COOLDOWN_SECONDS", "30"))
+
+# Notebook page thumbnails, rendered in the background on save
+THUMBNAIL_SIZE = int(os.getenv("THUMBNAIL_SIZE", "256"))
+THUMBNAIL_FORMAT = os.getenv("THUMBNAIL_FORMAT", "WEBP")  # falls back to PNG if Pillow lacks WebP
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+
+# Background solve jobs (/calculate/jobs)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "1"))
+
+# Notebook export/import archives (/notebook/export, /notebook/import)
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "20"))  # pages per cursor batch and per import write
+ARCHIVE_MAX_ENTRY_BYTES = int(os.getenv("ARCHIVE_MAX_ENTRY_BYTES", str(32 * 1024 * 1024)))
+# Most operations accepted by one /notebook/pages:bulk request
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "500"))
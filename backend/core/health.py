@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+from core.singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+OK, DEGRADED, UNAVAILABLE = "ok", "degraded", "unavailable"
+_SEVERITY = {OK: 0, DEGRADED: 1, UNAVAILABLE: 2}
+
+
+def grade(value: float, degraded_at: float, unavailable_at: float = None) -> str:
+    if unavailable_at is not None and value >= unavailable_at:
+        return UNAVAILABLE
+    return DEGRADED if value >= degraded_at else OK
+
+
+def worst(statuses) -> str:
+    return max(statuses, key=_SEVERITY.__getitem__, default=OK)
+
+
+async def loop_lag_probe() -> dict:
+    # How late a callback scheduled now actually runs, i.e. how busy the loop is
+    loop = asyncio.get_running_loop()
+    scheduled = loop.time()
+    await asyncio.sleep(0)
+    return {"lag_ms": round((loop.time() - scheduled) * 1000, 2)}
+
+
+class HealthCheck:
+    """Runs the readiness probes at most once per `ttl` seconds.
+
+    Load balancers, several of them and on every worker, poll readiness often;
+    callers within the ttl get the cached report and concurrent callers share one
+    probe run, so probing never adds real load to Mongo or the model. Each probe is
+    an async callable returning a dict with a "status" of ok, degraded or unavailable.
+    """
+
+    def __init__(self, probes: dict, ttl: float, timeout: float):
+        self.probes = probes
+        self.ttl = ttl
+        self.timeout = timeout
+        self.flights = SingleFlight()
+        self.report = None
+        self.checked_at = 0.0
+
+    async def _probe(self, name: str, probe) -> dict:
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(probe(), self.timeout)
+        except asyncio.TimeoutError:
+            result = {"status": UNAVAILABLE, "error": f"timed out after {self.timeout}s"}
+        except Exception as e:
+            result = {"status": UNAVAILABLE, "error": str(e)}
+        result.setdefault("status", OK)
+        result["probe_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        if result["status"] != OK:
+            logger.warning(f"Readiness probe {name} is {result['status']}: {result}")
+        return result
+
+    async def _run(self) -> dict:
+        results = await asyncio.gather(*(self._probe(name, probe) for name, probe in self.probes.items()))
+        checks = dict(zip(self.probes, results))
+        self.report = {"status": worst(check["status"] for check in checks.values()), "checks": checks}
+        self.checked_at = time.monotonic()
+        return self.report
+
+    async def check(self) -> dict:
+        if self.report is not None and time.monotonic() - self.checked_at < self.ttl:
+            return self.report
+        return await self.flights.do("health", self._run)
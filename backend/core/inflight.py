@@ -0,0 +1,19 @@
+class InflightTracker:
+    """Counts requests currently being served, reported by /readyz.
+
+    Shutdown does not wait on it: uvicorn only runs the lifespan shutdown once
+    connections have drained or timed out (timeout_graceful_shutdown), by
+    which point nothing is in flight any more.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.count = 0
+
+    async def __aenter__(self):
+        self.count += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self.count -= 1
+        return False
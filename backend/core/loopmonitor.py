@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_STACK_FRAMES = 25
+
+
+def _percentile(values: list, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def route_path(scope: dict) -> str:
+    """The matched route's template with the prefix it was included under, e.g.
+    /notebook/pages/{page_id}. The route only knows its path inside its router, so the
+    prefix is taken from the concrete path, which has the same number of segments after it.
+    Templates keep the per-route stats to one entry per endpoint rather than per page id."""
+    path = scope.get("path", "?")
+    template = getattr(scope.get("route"), "path", None)
+    if template is None or ":path}" in template:
+        return path  # unmatched, or a {name:path} parameter that spans segments
+    depth = path.count("/") - template.count("/")
+    if depth < 0:
+        return path
+    return "/".join(path.split("/")[:depth + 1]) + template
+
+
+def route_of(frame) -> str:
+    """Finds the request being served by walking the blocked stack outwards to the
+    nearest ASGI `scope`. Handlers run inside the request's task, so the router and
+    middleware frames that received the scope are still on the stack."""
+    while frame is not None:
+        # Checking the code object first avoids building f_locals for every frame
+        scope = frame.f_locals.get("scope") if "scope" in frame.f_code.co_varnames else None
+        if isinstance(scope, dict) and scope.get("type") in ("http", "websocket"):
+            return f"{scope.get('method', 'WS')} {route_path(scope)}"
+        frame = frame.f_back
+    return "(background)"
+
+
+class LoopMonitor:
+    """Measures event-loop lag and catches what blocks the loop.
+
+    A heartbeat task sleeps `interval` seconds at a time and records how late it
+    wakes up. A watchdog thread notices when the heartbeat stops beating for longer
+    than `threshold` and captures the loop thread's stack at that moment, so the
+    blocking call (a synchronous pymongo, bcrypt, PIL or model call in an async
+    handler) is recorded together with the route it ran in.
+    """
+
+    def __init__(self, interval: float, threshold: float, max_events: int = 50, window: int = 600):
+        self.interval = interval
+        self.threshold = threshold
+        self.lags = deque(maxlen=window)  # (monotonic time, lag in seconds)
+        self.events = deque(maxlen=max_events)
+        self.by_route = {}
+        self.blocked_total = 0
+        self.heartbeat = time.monotonic()
+        self.loop_thread = None
+        self.task = None
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+    def start(self):
+        self.loop_thread = threading.get_ident()
+        self.heartbeat = time.monotonic()
+        self._stopped.clear()
+        self.task = asyncio.create_task(self._beat())
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+        logger.info(f"Event loop monitor started (interval {self.interval}s, threshold {self.threshold}s)")
+
+    def stop(self):
+        self._stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+    async def _beat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self.heartbeat = now
+            self.lags.append((now, lag))
+            if lag >= self.threshold:
+                self._record(lag)
+
+    def _watch(self):
+        period = max(0.005, self.threshold / 4)
+        while not self._stopped.wait(period):
+            stalled = time.monotonic() - self.heartbeat - self.interval
+            if stalled < self.threshold:
+                continue
+            with self._lock:
+                if self._pending is not None and self._pending["heartbeat"] == self.heartbeat:
+                    continue  # this stall was already captured
+                heartbeat = self.heartbeat
+                frame = sys._current_frames().get(self.loop_thread)
+                if frame is None:
+                    continue
+                pending = {
+                    "heartbeat": heartbeat,
+                    "route": route_of(frame),
+                    "stack": traceback.format_list(traceback.extract_stack(frame)[-MAX_STACK_FRAMES:]),
+                }
+                # The loop may have moved on while the stack was being read
+                if self.heartbeat == heartbeat:
+                    self._pending = pending
+
+    def _record(self, lag: float):
+        with self._lock:
+            pending, self._pending = self._pending, None
+        # Stalls shorter than the watchdog period wake up before a stack is captured
+        route = pending["route"] if pending else "(unknown)"
+        lag_ms = round(lag * 1000, 1)
+        self.blocked_total += 1
+        stats = self.by_route.setdefault(route, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        stats["count"] += 1
+        stats["total_ms"] = round(stats["total_ms"] + lag_ms, 1)
+        stats["max_ms"] = max(stats["max_ms"], lag_ms)
+        self.events.append({
+            "at": datetime.now().isoformat(),
+            "blocked_ms": lag_ms,
+            "route": route,
+            "stack": [line.rstrip() for line in pending["stack"]] if pending else [],
+        })
+        where = pending["stack"][-1].strip().splitlines()[0] if pending else "unknown location"
+        logger.warning(f"Event loop blocked for {lag_ms}ms in {route} at {where}")
+
+    def lag_stats(self, seconds: float = None) -> dict:
+        since = time.monotonic() - seconds if seconds else 0.0
+        lags = [lag * 1000 for at, lag in self.lags if at >= since]
+        return {
+            "samples": len(lags),
+            "p50_ms": round(_percentile(lags, 0.5), 2) if lags else None,
+            "p99_ms": round(_percentile(lags, 0.99), 2) if lags else None,
+            "max_ms": round(max(lags), 2) if lags else None,
+        }
+
+    def metrics(self) -> dict:
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "interval_ms": self.interval * 1000,
+            "threshold_ms": self.threshold * 1000,
+            "lag": self.lag_stats(),
+            "blocked_total": self.blocked_total,
+            "blocked_by_route": self.by_route,
+        }
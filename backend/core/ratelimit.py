@@ -0,0 +1,180 @@
+import logging
+import math
+import time
+from dataclasses import dataclass
+from typing import Optional
+import jwt
+from fastapi import HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from pymongo import ReturnDocument
+from db.mongo import get_collection
+from constants import (
+    SECRET_KEY, ALGORITHM, RATE_LIMIT_ENABLED, RATE_LIMIT_BACKEND, RATE_LIMIT_IP_MULTIPLIER,
+    RATE_LIMIT_MODEL_BURST, RATE_LIMIT_MODEL_PER_MINUTE,
+    RATE_LIMIT_DEFAULT_BURST, RATE_LIMIT_DEFAULT_PER_MINUTE,
+    IS_DEV, FORWARDED_ALLOW_IPS, WEB_CONCURRENCY,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BucketPolicy:
+    capacity: float
+    refill_per_second: float
+
+    def scaled(self, factor: float) -> "BucketPolicy":
+        return BucketPolicy(self.capacity * factor, self.refill_per_second * factor)
+
+
+# Model-backed endpoints burn Gemini quota, CRUD endpoints only burn Mongo time
+POLICIES = {
+    "model": BucketPolicy(RATE_LIMIT_MODEL_BURST, RATE_LIMIT_MODEL_PER_MINUTE / 60),
+    "default": BucketPolicy(RATE_LIMIT_DEFAULT_BURST, RATE_LIMIT_DEFAULT_PER_MINUTE / 60),
+}
+
+
+def _retry_after(tokens: float, cost: float, policy: BucketPolicy) -> float:
+    if policy.refill_per_second <= 0:
+        return 60.0
+    return max(0.0, (cost - tokens) / policy.refill_per_second)
+
+
+class InMemoryBucketStore:
+    """Per-worker buckets. Only touched from the event loop, so no locking is needed."""
+
+    max_buckets = 100_000
+
+    def __init__(self):
+        self.buckets = {}
+
+    async def take(self, key: str, policy: BucketPolicy, cost: float = 1.0):
+        now = time.monotonic()
+        tokens, updated, _ = self.buckets.get(key, (policy.capacity, now, now))
+        tokens = min(policy.capacity, tokens + (now - updated) * policy.refill_per_second)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        # Once a bucket has refilled completely it is indistinguishable from a new one
+        full_at = now + _retry_after(tokens, policy.capacity, policy)
+        self.buckets[key] = (tokens, now, full_at)
+        if len(self.buckets) > self.max_buckets:
+            self.buckets = {k: v for k, v in self.buckets.items() if v[2] > now}
+        return allowed, 0.0 if allowed else _retry_after(tokens, cost, policy)
+
+
+class MongoBucketStore:
+    """Buckets shared by all workers, updated atomically with a pipeline update."""
+
+    def __init__(self, collection_name: str = "rate_limits"):
+        self.collection_name = collection_name
+
+    def _get_collection(self):
+        # Expired buckets are removed by the TTL index declared in db/indexes.py
+        return get_collection(self.collection_name)
+
+    def _take(self, key: str, policy: BucketPolicy, cost: float):
+        now = time.time()
+        full_after = policy.capacity / policy.refill_per_second if policy.refill_per_second else 3600
+        refilled = {"$min": [
+            policy.capacity,
+            {"$add": [
+                {"$ifNull": ["$tokens", policy.capacity]},
+                {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, policy.refill_per_second]},
+            ]},
+        ]}
+        doc = self._get_collection().find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", cost]}}},
+                {"$set": {
+                    "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", cost]}, "$tokens"]},
+                    "expires_at": {"$add": ["$$NOW", int(full_after * 1000)]},
+                }},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        allowed = doc["allowed"]
+        return allowed, 0.0 if allowed else _retry_after(doc["tokens"], cost, policy)
+
+    async def take(self, key: str, policy: BucketPolicy, cost: float = 1.0):
+        try:
+            return await run_in_threadpool(self._take, key, policy, cost)
+        except Exception as e:
+            # Fail open: an unreachable limiter must not take the whole API down
+            logger.warning(f"Rate limit store unavailable, allowing request: {str(e)}")
+            return True, 0.0
+
+
+def _build_store():
+    if RATE_LIMIT_BACKEND == "mongo":
+        return MongoBucketStore()
+    return InMemoryBucketStore()
+
+
+store = _build_store()
+
+
+def client_ip(request: Request) -> str:
+    # Only the real client when uvicorn trusts the proxy's X-Forwarded-For (FORWARDED_ALLOW_IPS)
+    return request.client.host if request.client else "unknown"
+
+
+def check_settings():
+    """Warns at startup about deployments where the limits do not mean what they say."""
+    if not RATE_LIMIT_ENABLED or IS_DEV:
+        return
+    if FORWARDED_ALLOW_IPS.strip() in ("127.0.0.1", "localhost", "::1"):
+        logger.warning(
+            "FORWARDED_ALLOW_IPS only trusts localhost: behind a remote load balancer every request "
+            "appears to come from the proxy, so all anonymous clients share one bucket and the IP "
+            "bucket caps the whole service. Set it to the load balancer's address (or '*' if only it can reach the app)"
+        )
+    if RATE_LIMIT_BACKEND != "mongo" and WEB_CONCURRENCY > 1:
+        logger.warning(
+            f"RATE_LIMIT_BACKEND=memory keeps buckets per worker, every limit is effectively "
+            f"multiplied by WEB_CONCURRENCY ({WEB_CONCURRENCY}). Use RATE_LIMIT_BACKEND=mongo to share them"
+        )
+
+
+def token_subject(request: Request) -> Optional[str]:
+    # Only the signature is checked here, the user lookup stays in get_current_user
+    auth = request.headers.get("authorization", "")
+    if not auth.lower().startswith("bearer "):
+        return None
+    try:
+        payload = jwt.decode(auth[7:], SECRET_KEY, algorithms=[ALGORITHM])
+    except jwt.PyJWTError:
+        return None
+    return payload.get("sub")
+
+
+def client_key(request: Request) -> str:
+    subject = token_subject(request)
+    return f"user:{subject}" if subject else f"anon:{client_ip(request)}"
+
+
+def rate_limit(bucket: str, cost: float = 1.0):
+    policy = POLICIES[bucket]
+    ip_policy = policy.scaled(RATE_LIMIT_IP_MULTIPLIER)
+
+    async def dependency(request: Request):
+        if not RATE_LIMIT_ENABLED:
+            return
+        key = client_key(request)
+        # The identity bucket stops a single account, the wider IP bucket stops
+        # one host cycling through accounts or tokens
+        checks = [(f"{bucket}:{key}", policy), (f"{bucket}:ip:{client_ip(request)}", ip_policy)]
+        for bucket_key, bucket_policy in checks:
+            allowed, retry_after = await store.take(bucket_key, bucket_policy, cost)
+            if not allowed:
+                logger.info(f"Rate limit exceeded for {bucket_key}")
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many requests, please slow down",
+                    headers={"Retry-After": str(math.ceil(retry_after))},
+                )
+
+    return dependency
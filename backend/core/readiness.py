@@ -0,0 +1,51 @@
+import asyncio
+import logging
+import time
+from fastapi.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+
+class Readiness:
+    """Tracks the components a worker warms up after it starts accepting connections.
+
+    The worker serves as soon as the app is imported; /readyz only reports ready
+    once every component has warmed up, so a load balancer can hold traffic back.
+    """
+
+    def __init__(self, components: list):
+        self.components = {name: {"ready": False, "error": None, "seconds": None} for name in components}
+        self.started = time.perf_counter()
+
+    @property
+    def ready(self) -> bool:
+        return all(component["ready"] for component in self.components.values())
+
+    def mark_ready(self, name: str):
+        self.components[name].update({"ready": True, "error": None, "seconds": round(time.perf_counter() - self.started, 3)})
+
+    def mark_failed(self, name: str, error: str):
+        self.components[name]["error"] = error
+
+    def report(self) -> dict:
+        return {name: dict(component) for name, component in self.components.items()}
+
+
+async def warm_up(readiness: Readiness, steps: dict, retry_seconds: float):
+    """Runs each blocking warm-up step in the threadpool, retrying failed ones
+    until all of them succeed or the task is cancelled on shutdown."""
+    pending = dict(steps)
+    while pending:
+        for name, step in list(pending.items()):
+            try:
+                await run_in_threadpool(step)
+            except Exception as e:
+                logger.error(f"Warm-up of {name} failed, retrying in {retry_seconds}s: {str(e)}")
+                readiness.mark_failed(name, str(e))
+                continue
+            readiness.mark_ready(name)
+            del pending[name]
+            logger.info(f"Warm-up of {name} done after {readiness.components[name]['seconds']}s")
+        if pending:
+            await asyncio.sleep(retry_seconds)
+    logger.info("Worker is ready")
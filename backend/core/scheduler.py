@@ -0,0 +1,86 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, status
+
+
+class FairScheduler:
+    """Bounds concurrent model calls and, once saturated, hands free slots to
+    waiting clients round-robin instead of first-come-first-served, so one
+    client with a deep queue cannot starve everyone else."""
+
+    def __init__(self, max_concurrency: int, max_queued_per_client: int):
+        self.max_concurrency = max_concurrency
+        self.max_queued_per_client = max_queued_per_client
+        self.active = 0
+        self.waiters = {}        # client key -> deque of futures
+        self.rotation = deque()  # client keys with at least one waiter
+
+    @property
+    def queued(self) -> int:
+        return sum(len(q) for q in self.waiters.values())
+
+    def admit(self, key: str):
+        """Rejects a client that already has max_queued_per_client calls waiting.
+
+        Checked for every caller before any work is shared, so requests that are
+        coalesced into someone else's call are judged by their own queue only.
+        """
+        saturated = self.active >= self.max_concurrency or self.rotation
+        if saturated and len(self.waiters.get(key, ())) >= self.max_queued_per_client:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many pending requests, wait for the previous ones to finish",
+                headers={"Retry-After": "1"},
+            )
+
+    async def acquire(self, key: str):
+        if self.active < self.max_concurrency and not self.rotation:
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(key, deque()).append(future)
+        if key not in self.rotation:
+            self.rotation.append(key)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we were cancelled, pass it on
+                self.release()
+            else:
+                self._discard(key, future)
+            raise
+
+    def release(self):
+        while self.rotation:
+            key = self.rotation.popleft()
+            queue = self.waiters[key]
+            future = queue.popleft()
+            if queue:
+                self.rotation.append(key)
+            else:
+                del self.waiters[key]
+            if not future.done():
+                # The slot moves straight to the waiter, active stays unchanged
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    def _discard(self, key: str, future):
+        queue = self.waiters.get(key)
+        if queue is None or future not in queue:
+            return
+        queue.remove(future)
+        if not queue:
+            del self.waiters[key]
+            self.rotation.remove(key)
+
+    @asynccontextmanager
+    async def slot(self, key: str):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
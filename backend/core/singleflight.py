@@ -0,0 +1,55 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Coalesces concurrent calls with the same key into one execution.
+
+    Every caller awaits the same task and receives its result (or exception).
+    A caller that is cancelled only stops waiting; the shared task is cancelled
+    once the last waiter has gone. Nothing is kept after the task finishes, so
+    this is deduplication of in-flight work, not a cache.
+    """
+
+    def __init__(self):
+        self.calls = {}
+        self.coalesced = 0
+
+    async def do(self, key: str, fn):
+        call = self.calls.get(key)
+        # A cancelled call is forgotten when cancelled, this only guards the window before that
+        if call is None or call.task.cancelled():
+            call = _Call(asyncio.ensure_future(fn()))
+            self.calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+            logger.info(f"Joining in-flight call {key[:12]} ({call.waiters} waiting)")
+
+        call.waiters += 1
+        try:
+            # shield() keeps one waiter's cancellation from cancelling the others
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                logger.info(f"All waiters left call {key[:12]}, cancelling it")
+                # Forget it right away: the done callback only runs once the task has
+                # unwound, and a caller joining before that would get a cancellation
+                # it never asked for
+                self._forget(key, call)
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        if self.calls.get(key) is call:
+            del self.calls[key]
@@ -0,0 +1,105 @@
+import argparse
+import logging
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from db.mongo import get_database
+
+logger = logging.getLogger(__name__)
+
+# Every index the app relies on, created idempotently at startup
+INDEXES = {
+    "users": [
+        # get_user runs on every authenticated request, signup relies on it for uniqueness
+        IndexModel([("email", ASCENDING)], unique=True, name="email_unique"),
+    ],
+    "calculation_jobs": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0, name="expires_at_ttl"),
+    ],
+}
+
+# Indexes earlier versions created that no query uses any more, dropped at startup.
+# Page lookups always filter on _id as well, so the multikey index on
+# notebook_pages.id never won a plan and only made every page write more expensive
+OBSOLETE_INDEXES = {
+    "users": ["notebook_pages_id"],
+}
+
+# The filters our request paths run most often, with placeholder values
+HOT_QUERIES = [
+    ("users", {"email": "probe@example.com"}),
+    ("users", {"_id": ObjectId()}),
+    ("users", {"_id": ObjectId(), "notebook_pages.id": "probe"}),
+    ("page_thumbnails", {"_id": "probe:probe"}),
+    ("calculation_jobs", {"_id": "probe"}),
+    ("variable_graphs", {"_id": "probe"}),
+]
+
+
+def ensure_indexes(db=None):
+    db = db if db is not None else get_database()
+    for collection_name, indexes in INDEXES.items():
+        try:
+            created = db[collection_name].create_indexes(indexes)
+            logger.info(f"Indexes ready on {collection_name}: {', '.join(created)}")
+        except OperationFailure as e:
+            # e.g. duplicate emails from before the unique index existed, keep serving
+            logger.error(f"Failed to create indexes on {collection_name}: {str(e)}")
+    for collection_name, names in OBSOLETE_INDEXES.items():
+        existing = set(db[collection_name].index_information())
+        for name in names:
+            if name not in existing:
+                continue
+            try:
+                db[collection_name].drop_index(name)
+                logger.info(f"Dropped unused index {name} on {collection_name}")
+            except OperationFailure as e:
+                # Another worker starting at the same time may have dropped it first
+                logger.info(f"Index {name} on {collection_name} not dropped: {str(e)}")
+
+
+def _stages(plan: dict):
+    yield plan.get("stage")
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+
+def check_query_plans(db=None):
+    """Explains every hot query and returns the ones whose winning plan scans the collection."""
+    db = db if db is not None else get_database()
+    report = []
+    for collection_name, query in HOT_QUERIES:
+        explain = db.command("explain", {"find": collection_name, "filter": query, "limit": 1},
+                             verbosity="queryPlanner")
+        stages = [stage for stage in _stages(explain["queryPlanner"]["winningPlan"]) if stage]
+        entry = {
+            "collection": collection_name,
+            "filter": sorted(query),
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+        }
+        if entry["collscan"]:
+            logger.warning(f"COLLSCAN for {collection_name} filter on {entry['filter']}")
+        report.append(entry)
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Create MongoDB indexes and check hot query plans")
+    parser.add_argument("--explain-only", action="store_true", help="only report query plans")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if not args.explain_only:
+        ensure_indexes()
+    report = check_query_plans()
+    for entry in report:
+        flag = "COLLSCAN" if entry["collscan"] else "ok"
+        print(f"{flag:9} {entry['collection']:18} {','.join(entry['filter']):24} {' <- '.join(entry['stages'])}")
+    raise SystemExit(1 if any(entry["collscan"] for entry in report) else 0)
@@ -1,37 +1,50 @@
 from pymongo import MongoClient
 from pymongo.errors import ConnectionFailure, ServerSelectionTimeoutError
-from constants import MONGO_URI
+from constants import MONGO_URI, MONGO_MAX_POOL_SIZE
 import logging
+import threading
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 client = None
+_client_lock = threading.Lock()
 
 def get_database():
     global client
     if client is None:
-        try:
-            logger.info(f"Connecting to MongoDB at {MONGO_URI if MONGO_URI != 'mongodb://localhost:27017' else 'default localhost'}")
-            client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000)
+        # The startup warm-up and early requests may connect at the same time from different threads
+        with _client_lock:
+            if client is None:
+                try:
+                    logger.info(f"Connecting to MongoDB at {MONGO_URI if MONGO_URI != 'mongodb://localhost:27017' else 'default localhost'}")
+                    client = MongoClient(MONGO_URI, serverSelectionTimeoutMS=5000, maxPoolSize=MONGO_MAX_POOL_SIZE)
             
-            # Verify connection is working
-            client.admin.command('ping')
-            logger.info("MongoDB connection successful")
+                    # Verify connection is working
+                    client.admin.command('ping')
+                    logger.info("MongoDB connection successful")
             
-        except ConnectionFailure as e:
-            logger.error(f"MongoDB connection failed: {str(e)}")
-            raise
-        except ServerSelectionTimeoutError as e:
-            logger.error(f"MongoDB server selection timeout: {str(e)}")
-            raise
-        except Exception as e:
-            logger.error(f"Unexpected MongoDB error: {str(e)}")
-            raise
+                except ConnectionFailure as e:
+                    logger.error(f"MongoDB connection failed: {str(e)}")
+                    raise
+                except ServerSelectionTimeoutError as e:
+                    logger.error(f"MongoDB server selection timeout: {str(e)}")
+                    raise
+                except Exception as e:
+                    logger.error(f"Unexpected MongoDB error: {str(e)}")
+                    raise
             
     return client["inkquiry"]
 
+def close_database():
+    # Called on worker shutdown so each worker releases its own connection pool
+    global client
+    if client is not None:
+        client.close()
+        client = None
+        logger.info("MongoDB connection closed")
+
 def get_collection(collection_name):
     try:
         db = get_database()
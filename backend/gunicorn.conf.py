@@ -0,0 +1,33 @@
+# Production launch with gunicorn managing uvicorn workers:
+#   gunicorn main:app -c gunicorn.conf.py
+# All values come from the environment via constants.py
+from constants import (
+    SERVER_URL, PORT, WEB_CONCURRENCY, KEEP_ALIVE_TIMEOUT, BACKLOG,
+    LIMIT_CONCURRENCY, GRACEFUL_SHUTDOWN_TIMEOUT, HTTP_DRAIN_TIMEOUT, FORWARDED_ALLOW_IPS,
+    WORKER_TIMEOUT,
+)
+from uvicorn_worker import UvicornWorker
+
+
+class Worker(UvicornWorker):
+    # UvicornWorker waits on in-flight calls without a limit unless told otherwise,
+    # which would let the HTTP drain eat the time left for queued jobs. gunicorn has
+    # no setting for uvicorn's concurrency limit, so it is passed through here too
+    CONFIG_KWARGS = {
+        **UvicornWorker.CONFIG_KWARGS,
+        "timeout_graceful_shutdown": HTTP_DRAIN_TIMEOUT,
+        "limit_concurrency": LIMIT_CONCURRENCY,
+    }
+
+
+bind = f"{SERVER_URL}:{PORT}"
+workers = WEB_CONCURRENCY
+worker_class = Worker
+backlog = BACKLOG
+keepalive = KEEP_ALIVE_TIMEOUT
+graceful_timeout = GRACEFUL_SHUTDOWN_TIMEOUT
+# Model calls can legitimately take a while, only kill workers that stop heartbeating
+timeout = WORKER_TIMEOUT
+forwarded_allow_ips = FORWARDED_ALLOW_IPS
+# Each worker opens its own Mongo/Gemini clients in the app lifespan, so never preload
+preload_app = False
@@ -1,14 +1,30 @@
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, Request, status
+from fastapi import FastAPI, Depends, Request, status
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 import uvicorn
+import asyncio
 import logging
 import time
-from apps.calculator.route import router as calculator_router
+from importlib.util import find_spec
+from fastapi.concurrency import run_in_threadpool
+from apps.calculator.route import (
+    router as calculator_router, inflight as calculate_inflight, jobs as calculate_jobs,
+    scheduler as calculate_scheduler,
+)
 from apps.auth.route import router as auth_router
 from apps.notebook.route import router as notebook_router
-from constants import SERVER_URL, PORT, ENV
+from core.ratelimit import check_settings as check_rate_limit_settings, rate_limit
+from core.readiness import Readiness, warm_up
+from core.health import HealthCheck, DEGRADED, OK, UNAVAILABLE, grade, loop_lag_probe, worst
+from core.loopmonitor import LoopMonitor
+from constants import (
+    SERVER_URL, PORT, IS_DEV, WEB_CONCURRENCY, KEEP_ALIVE_TIMEOUT, BACKLOG,
+    LIMIT_CONCURRENCY, HTTP_DRAIN_TIMEOUT, JOB_DRAIN_TIMEOUT, FORWARDED_ALLOW_IPS, WARMUP_RETRY_SECONDS,
+    HEALTH_CACHE_SECONDS, HEALTH_PROBE_TIMEOUT, HEALTH_DB_DEGRADED_MS, HEALTH_MAX_QUEUED,
+    HEALTH_LOOP_LAG_DEGRADED_MS, HEALTH_LOOP_LAG_UNAVAILABLE_MS, JOB_QUEUE_SIZE,
+    LOOP_MONITOR_ENABLED, LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD, DEBUG_ENDPOINTS,
+)
 
 # Configure logging
 logging.basicConfig(
@@ -17,23 +33,123 @@ logging.basicConfig(
 )
 logger = logging.getLogger("inkquiry")
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    # Initialize MongoDB connection
+def warm_database():
     from db.mongo import get_database
+    from db.indexes import ensure_indexes, check_query_plans
     logger.info("Initializing MongoDB connection")
+    db = get_database()
+    db.command("ping")  # opens the first pooled connection
+    logger.info("MongoDB initialized successfully")
+    ensure_indexes(db)
     try:
-        get_database()
-        logger.info("MongoDB initialized successfully")
+        collscans = [entry for entry in check_query_plans(db) if entry["collscan"]]
+        if collscans:
+            logger.warning(f"{len(collscans)} hot query(ies) fall back to a collection scan, run python -m db.indexes")
     except Exception as e:
-        logger.error(f"Failed to initialize MongoDB: {str(e)}")
+        logger.error(f"Failed to check query plans: {str(e)}")
+
+def warm_model():
+    from apps.calculator.backends import inference
+    inference.init()
+    if not inference.ready:
+        raise RuntimeError("Model client is not initialized")
+    # Imported on first use otherwise, load them before the first request needs them
+    from apps.notebook.thumbnails import output_format
+    from apps.auth.utils import password_context
+    output_format()
+    password_context()
+
+# Shared with /readyz, flips once every warm-up step has succeeded
+readiness = Readiness(["database", "model"])
+
+async def probe_database():
+    from db.mongo import get_database
+    started = time.perf_counter()
+    await run_in_threadpool(lambda: get_database().command("ping"))
+    latency_ms = (time.perf_counter() - started) * 1000
+    return {"status": grade(latency_ms, HEALTH_DB_DEGRADED_MS), "latency_ms": round(latency_ms, 2)}
+
+async def probe_model():
+    # Circuit state rather than a live call, probing must not spend model quota.
+    # With the model's circuit open requests fall back to the next backend (the stub)
+    from apps.calculator.backends import inference
+    backends = inference.stats()
+    circuits = [backend["circuit"] for backend in backends.values()]
+    if not inference.ready or all(circuit == "open" for circuit in circuits):
+        status = UNAVAILABLE
+    else:
+        status = DEGRADED if circuits[0] == "open" else OK
+    return {"status": status, "backends": backends}
+
+async def probe_queues():
+    queued = calculate_scheduler.queued
+    jobs_queued = calculate_jobs.queue.qsize()
+    return {
+        "status": worst([
+            grade(queued, HEALTH_MAX_QUEUED / 2, HEALTH_MAX_QUEUED),
+            grade(jobs_queued, JOB_QUEUE_SIZE / 2),
+        ]),
+        "inference_active": calculate_scheduler.active,
+        "inference_queued": queued,
+        "jobs_queued": jobs_queued,
+        "calculate_inflight": calculate_inflight.count,
+    }
+
+# Flags synchronous calls that stall every request on the worker, see /debug/event-loop
+loop_monitor = LoopMonitor(LOOP_MONITOR_INTERVAL, LOOP_BLOCK_THRESHOLD)
+
+async def probe_event_loop():
+    if not LOOP_MONITOR_ENABLED:
+        result = await loop_lag_probe()
+        result["status"] = grade(result["lag_ms"], HEALTH_LOOP_LAG_DEGRADED_MS, HEALTH_LOOP_LAG_UNAVAILABLE_MS)
+        return result
+    # p99 over the last few seconds, a single sample would miss intermittent stalls
+    lag = loop_monitor.lag_stats(seconds=10)
+    p99 = lag["p99_ms"] or 0.0
+    status = grade(p99, HEALTH_LOOP_LAG_DEGRADED_MS, HEALTH_LOOP_LAG_UNAVAILABLE_MS)
+    return {"status": status, "lag_ms": lag["p50_ms"], "lag_p99_ms": lag["p99_ms"], "blocked_total": loop_monitor.blocked_total}
+
+health = HealthCheck(
+    {"database": probe_database, "model": probe_model, "queues": probe_queues, "event_loop": probe_event_loop},
+    ttl=HEALTH_CACHE_SECONDS,
+    timeout=HEALTH_PROBE_TIMEOUT,
+)
+started_at = time.time()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Clients are built after startup rather than at import time so that every
+    # worker process gets its own connection pool and model client after fork.
+    # Warm-up runs in the background, the worker accepts connections right away
+    # and /readyz tells the load balancer when to start sending traffic
+    from db.mongo import close_database
+    from apps.notebook import thumbnails
+    check_rate_limit_settings()
+    if LOOP_MONITOR_ENABLED:
+        loop_monitor.start()
+    warmup = asyncio.create_task(
+        warm_up(readiness, {"database": warm_database, "model": warm_model}, WARMUP_RETRY_SECONDS)
+    )
+    calculate_jobs.start()
     yield
+    warmup.cancel()
+    # Running /calculate calls were drained by uvicorn already, queued jobs get the
+    # rest of the shutdown budget so the worker exits before gunicorn kills it
+    await calculate_jobs.stop(JOB_DRAIN_TIMEOUT)
+    thumbnails.shutdown()
+    close_database()
+    loop_monitor.stop()
 
 app = FastAPI(lifespan=lifespan)
 
+PROBE_PATHS = ("/healthz", "/readyz")
+
 # Add request logging middleware
 @app.middleware("http")
 async def log_requests(request: Request, call_next):
+    # Load balancers poll the probes every few seconds, keep them out of the logs
+    if request.url.path in PROBE_PATHS:
+        return await call_next(request)
     request_id = str(time.time())
     logger.info(f"[{request_id}] {request.method} {request.url.path} started")
     
@@ -80,10 +196,56 @@ app.add_middleware(
 async def root():
     return {"message": "Server is running"}
 
+@app.get('/healthz')
+async def healthz():
+    # Liveness only: answering at all means the process and its event loop are alive
+    return {"status": "alive", "uptime_seconds": round(time.time() - started_at, 1)}
+
+@app.get('/readyz')
+async def readyz():
+    # 503 until the Mongo pool and the model client are warm, then whenever a probe
+    # is unavailable. Degraded workers keep receiving traffic, they can still serve it
+    if not readiness.ready:
+        body = {"status": "starting", "warmup": readiness.report()}
+        return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content=body)
+    report = await health.check()
+    code = status.HTTP_503_SERVICE_UNAVAILABLE if report["status"] == UNAVAILABLE else status.HTTP_200_OK
+    return JSONResponse(status_code=code, content=report)
+
+if DEBUG_ENDPOINTS:
+    @app.get('/debug/event-loop')
+    async def debug_event_loop():
+        # Lag percentiles, blocking stalls per route and the stacks of the most recent ones
+        return {**loop_monitor.metrics(), "events": list(loop_monitor.events)}
+
+# Calculator routes pick their own bucket: solving costs model quota, polling a job does not
 app.include_router(calculator_router, prefix="/calculate", tags=["calculate"])
-app.include_router(auth_router, prefix="/auth", tags=["authentication"])
-app.include_router(notebook_router, prefix="/notebook", tags=["notebook"])
+app.include_router(auth_router, prefix="/auth", tags=["authentication"], dependencies=[Depends(rate_limit("default"))])
+app.include_router(notebook_router, prefix="/notebook", tags=["notebook"], dependencies=[Depends(rate_limit("default"))])
+
+
+def server_options():
+    if IS_DEV:
+        return {"host": SERVER_URL, "port": int(PORT), "reload": True}
+
+    # Prefer the C implementations when installed (uvicorn[standard])
+    loop = "uvloop" if find_spec("uvloop") else "asyncio"
+    http = "httptools" if find_spec("httptools") else "h11"
+    logger.info(f"Production server: {WEB_CONCURRENCY} worker(s), loop={loop}, http={http}")
+    return {
+        "host": SERVER_URL,
+        "port": int(PORT),
+        "workers": WEB_CONCURRENCY,
+        "loop": loop,
+        "http": http,
+        "backlog": BACKLOG,
+        "timeout_keep_alive": KEEP_ALIVE_TIMEOUT,
+        "limit_concurrency": LIMIT_CONCURRENCY,
+        "timeout_graceful_shutdown": HTTP_DRAIN_TIMEOUT,
+        "proxy_headers": True,
+        "forwarded_allow_ips": FORWARDED_ALLOW_IPS,
+    }
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host=SERVER_URL, port=int(PORT), reload=(ENV == "dev"))
\ No newline at end of file
+    uvicorn.run("main:app", **server_options())
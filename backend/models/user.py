@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, EmailStr, validator
-from typing import Optional, List, Dict, Union
+from typing import Any, Optional, List, Dict, Literal, Union
 from datetime import datetime
 
 
@@ -31,6 +31,8 @@ class NotebookPage(BaseModel):
     name: str
     date_created: Union[datetime, str]  # Allow datetime or string format
     content: Optional[List[Dict[str, str]]] = []
+    # Solved {'expr', 'result', 'assign'} outputs, filled in by /calculate
+    results: Optional[List[Dict[str, Any]]] = []
     canvas_data: Optional[str] = None
     canvasData: Optional[str] = None  # Add explicit camelCase field
     
@@ -69,6 +71,32 @@ class NotebookPage(BaseModel):
         return data
 
 
+class PageChanges(BaseModel):
+    # Only the fields that are sent are changed
+    name: Optional[str] = None
+    content: Optional[List[Dict[str, str]]] = None
+    results: Optional[List[Dict[str, Any]]] = None
+    canvas_data: Optional[str] = None
+
+
+class PageOperation(BaseModel):
+    op: Literal["create", "update", "delete", "move"]
+    page: Optional[NotebookPage] = None  # create
+    id: Optional[str] = None  # update, delete, move
+    changes: Optional[PageChanges] = None  # update
+    position: Optional[int] = None  # move, index in the page list after the move
+
+
+class BulkPageOperations(BaseModel):
+    operations: List[PageOperation]
+    # Ordered stops at the first operation that fails, unordered applies every valid one
+    ordered: bool = True
+
+
+class VariableUpdate(BaseModel):
+    value: Union[float, int, str]
+
+
 class UserDB(UserBase):
     id: str = Field(...)
     hashed_password: str
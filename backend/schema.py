@@ -1,5 +1,8 @@
 from pydantic import BaseModel
+from typing import Optional
 
 class ImageData(BaseModel):
     image: str
-    dict_of_vars: dict
\ No newline at end of file
+    dict_of_vars: dict
+    # Notebook page the canvas belongs to, lets the server keep its variables
+    page_id: Optional[str] = None
@@ -0,0 +1,51 @@
+import argparse
+import os
+import subprocess
+import sys
+from collections import defaultdict
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def import_times(module: str) -> list:
+    """Imports module in a fresh interpreter with -X importtime and returns
+    (name, self_us, cumulative_us, depth) for every module it pulled in."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=BACKEND_DIR, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise SystemExit(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        entries.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return entries
+
+
+def report(module: str, top: int):
+    entries = import_times(module)
+    total = next((cumulative for name, _, cumulative, _ in entries if name == module), 0)
+    print(f"import {module}: {total / 1000:.1f} ms, {len(entries)} modules\n")
+
+    by_package = defaultdict(int)
+    for name, self_us, _, _ in entries:
+        by_package[name.split(".")[0]] += self_us
+    print(f"{'package':32} {'ms':>8} {'share':>7}")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:top]:
+        print(f"{package:32} {self_us / 1000:8.1f} {self_us / max(total, 1):7.1%}")
+
+    print(f"\n{'slowest imports (cumulative)':48} {'ms':>8}")
+    for name, _, cumulative, depth in sorted(entries, key=lambda entry: -entry[2])[:top]:
+        print(f"{'  ' * min(depth, 4) + name:48} {cumulative / 1000:8.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Import-time breakdown of the app's cold start")
+    parser.add_argument("--module", default="main", help="module to import, default main")
+    parser.add_argument("--top", type=int, default=20, help="rows per table")
+    args = parser.parse_args()
+    report(args.module, args.top)
@@ -0,0 +1,121 @@
+import math
+import pytest
+from apps.notebook.variables import VariableGraph, compile_formula, evaluate, latex_to_python
+
+
+def value_of(expr: str, names: frozenset = frozenset(), **variables):
+    return evaluate(compile_formula(expr, names).tree, variables)
+
+
+def dependencies_of(expr: str, names: frozenset = frozenset()):
+    return set(compile_formula(expr, names).dependencies)
+
+
+@pytest.mark.parametrize("expr, expected", [
+    ("2x", "2*x"),
+    ("2(x+1)", "2*(x+1)"),
+    ("(a)(b)", "(a)*(b)"),
+    ("(a)x", "(a)*x"),
+    ("xy", "x*y"),
+    ("2xy", "2*x*y"),
+    ("2e3", "2e3"),
+    ("1.5e-3x", "1.5e-3*x"),
+    ("f(x)", "f(x)"),
+    ("x_1 + v0", "x_1 + v0"),
+    ("\\sin x", "sin(x)"),
+    ("\\pi x", "pi*x"),
+    ("\\frac{x}{2}", "((x)/(2))"),
+    ("\\sqrt{\\frac{a}{b}}", "sqrt(((a)/(b)))"),
+    ("x^2 \\cdot y", "x**2 * y"),
+    ("\\text{speed} t", "speed*t"),
+])
+def test_latex_to_python(expr, expected):
+    assert latex_to_python(expr) == expected
+
+
+def test_latex_to_python_keeps_known_names_whole():
+    assert latex_to_python("2speed + xy", frozenset({"speed"})) == "2*speed + x*y"
+    assert latex_to_python("xy", frozenset({"xy"})) == "xy"
+
+
+def test_scientific_notation_is_a_number():
+    assert dependencies_of("2e3") == set()
+    assert value_of("2e3") == 2000
+    assert value_of("2e") == 2 * math.e
+    assert dependencies_of("1.5e-3x") == {"x"}
+
+
+def test_letters_are_products_unless_known():
+    assert dependencies_of("xy") == {"x", "y"}
+    assert value_of("xy", x=2, y=3) == 6
+    assert dependencies_of("xy", frozenset({"xy"})) == {"xy"}
+    assert dependencies_of("\\sin x + pi") == {"x"}
+
+
+def test_unknown_functions_are_left_to_the_model():
+    assert compile_formula("f(x)") is None
+    assert compile_formula("g(2) + 1") is None
+
+
+def test_compile_formula_definitions():
+    formula = compile_formula("y = 3x + 1")
+    assert formula.target == "y"
+    assert formula.dependencies == {"x"}
+    # An equation to solve, not a definition
+    assert compile_formula("x^2 = 4") is None
+    assert compile_formula("x > 2") is None
+    assert compile_formula("'a' + 1") is None
+
+
+def test_propagate_follows_definitions_in_order():
+    graph = VariableGraph("user")
+    graph.record_results("p1", [{"expr": "x", "result": 2, "assign": True}])
+    graph.record_results("p2", [
+        {"expr": "z = y + 1", "result": 7},
+        {"expr": "y = 3x", "result": 6},
+        {"expr": "2z", "result": 14},
+    ])
+    updated = {node["expr"]: node["result"] for node in graph.set_variable("x", 10)}
+    assert updated == {"y = 3x": 30, "z = y + 1": 31, "2z": 62}
+    assert graph.variables == {"x": 10, "y": 30, "z": 31}
+
+
+def test_propagate_recomputes_only_dependents():
+    graph = VariableGraph("user", {"a": 1, "b": 2})
+    graph.record_results("p1", [{"expr": "a + 1", "result": 2}, {"expr": "b + 1", "result": 3}])
+    assert [node["expr"] for node in graph.set_variable("a", 5)] == ["a + 1"]
+
+
+def test_propagate_skips_cycles():
+    graph = VariableGraph("user", {"z": 1})
+    graph.record_results("p1", [{"expr": "x = y + 1", "result": 0}, {"expr": "y = x + z", "result": 0}])
+    assert graph.set_variable("z", 2) == []
+
+
+def test_propagate_skips_conflicting_definitions():
+    graph = VariableGraph("user", {"x": 1})
+    graph.record_results("p1", [{"expr": "y = 2x", "result": 2}, {"expr": "y + 1", "result": 3}])
+    graph.record_results("p2", [{"expr": "y = 10", "result": 10}])
+    assert set(graph.conflicts()) == {"y"}
+    assert graph.set_variable("x", 5) == []
+    # Deleting one definition applies the other with the current values
+    updated = {node["expr"]: node["result"] for node in graph.remove_page("p2")}
+    assert updated == {"y = 2x": 10, "y + 1": 11}
+
+
+def test_multi_letter_variables_are_indexed_once_known():
+    graph = VariableGraph("user")
+    graph.record_results("p1", [{"expr": "2speed", "result": 0}])
+    graph.record_results("p2", [{"expr": "speed", "result": 3, "assign": True}])
+    assert graph.set_variable("speed", 4)[0]["result"] == 8
+
+
+def test_resolving_a_page_replaces_its_definitions():
+    graph = VariableGraph("user")
+    graph.record_results("p1", [{"expr": "x", "result": 4, "assign": True}, {"expr": "y = 2x", "result": 8}])
+    graph.record_results("p1", [])
+    assert graph.variables == {}
+    assert graph.expressions == {}
+    graph.record_results("p1", [{"expr": "x", "result": 1, "assign": True}])
+    graph.record_results("p2", [{"expr": "x", "result": 2, "assign": True}])
+    assert set(graph.conflicts()) == {"x"}